@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import math
+import multiprocessing as mp
+import os
+import signal
+import time
+from typing import Dict, Any, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from detector_fugas import DetectorFugas, muestra, tramo_vigilado
+from headless import EjecucionHeadless, cargar_linea_tiempo
+from mqtt_simulator import SistemaSimulacion
+from topologia import TOPOLOGIA_POR_DEFECTO, Topologia, cargar_topologia
+
+
+# Umbrales (fracción de la capacidad) para los instantes de llenado y vaciado
+LLENO = 0.99
+VACIO = 0.01
+
+
+def _capacidad(sistema: SistemaSimulacion, valor: float, tanques: Optional[Iterable[str]] = None):
+    # Conserva la fracción de llenado inicial: un tanque lleno sigue lleno con la nueva capacidad
+    for tanque_id in tanques or sistema.tanques:
+        tanque = sistema.tanques[tanque_id]
+        tanque.nivel_actual = tanque.nivel_actual / tanque.capacidad * valor
+        tanque.capacidad = valor
+
+
+def aplicar_parametro(sistema: SistemaSimulacion, nombre: str, valor: Any):
+    """Aplica un parámetro del barrido: flujo_base, capacidad (todos los tanques) o capacidad.<tanque>"""
+    if nombre == "flujo_base":
+        sistema.flujo_base = float(valor)
+    elif nombre == "capacidad":
+        _capacidad(sistema, float(valor))
+    elif nombre.startswith("capacidad."):
+        tanque_id = nombre.split(".", 1)[1]
+        if tanque_id not in sistema.tanques:
+            raise ValueError(f"Tanque desconocido en {nombre}: {tanque_id}")
+        _capacidad(sistema, float(valor), [tanque_id])
+    elif nombre == "intensidad":
+        # No toca el sistema: reemplaza la de los simular_fuga de la línea de tiempo
+        validar_parametro(sistema.topologia, nombre)
+    else:
+        raise ValueError(f"Parámetro desconocido: {nombre}")
+
+
+def validar_parametro(topologia: Topologia, nombre: str):
+    """Rechaza parámetros que no cambiarían el resultado en esta topología"""
+    if nombre == "intensidad" and topologia.modelo != "red":
+        # El modelo de 4 tanques aplica siempre la misma caída de presión, sin importar la intensidad
+        raise ValueError(
+            f"intensidad solo tiene efecto con \"modelo\": \"red\" (la topología {topologia.nombre} "
+            f"usa {topologia.modelo})"
+        )
+
+
+def _con_intensidad(eventos: List[Dict[str, Any]], intensidad: float) -> List[Dict[str, Any]]:
+    return [
+        {**e, "comando": {**e["comando"], "intensidad": intensidad}}
+        if e["comando"].get("comando") == "simular_fuga"
+        else e
+        for e in eventos
+    ]
+
+
+def columnas_resumen(topologia: Topologia) -> List[str]:
+    """Métricas por corrida (mismas columnas para todas las corridas de una topología)"""
+    columnas = []
+    for t in topologia.tanques:
+        columnas += [f"t_llenado.{t.id}", f"t_vaciado.{t.id}", f"nivel_final.{t.id}"]
+    return columnas + ["flujo_medio", "flujo_max", "t_alarma_fuga", "ticks", "t_simulado", "segundos"]
+
+
+def ejecutar_corrida(corrida: Dict[str, Any]) -> Dict[str, Any]:
+    """Ejecuta una corrida headless y devuelve sus métricas resumen (se ejecuta en el pool)"""
+    inicio = time.perf_counter()
+    topologia = cargar_topologia(corrida["topologia"])
+    sistema = SistemaSimulacion(topologia, corrida["semilla"])
+    eventos = corrida["eventos"]
+    for nombre, valor in corrida["parametros"].items():
+        aplicar_parametro(sistema, nombre, valor)
+        if nombre == "intensidad":
+            eventos = _con_intensidad(eventos, float(valor))
+
+    ejecucion = EjecucionHeadless(
+        sistema, eventos, corrida["dt"], corrida["adaptativo"], corrida["dt_max"]
+    )
+    tanques = list(sistema.tanques.values())
+    capacidad = np.array([t.capacidad for t in tanques])
+    nivel = np.array([t.nivel_actual for t in tanques])
+    # Solo se mide el llenado de los que empiezan sin llenar (y el vaciado de los que no empiezan vacíos)
+    t_llenado = np.where(nivel >= LLENO * capacidad, np.nan, np.inf)
+    t_vaciado = np.where(nivel <= VACIO * capacidad, np.nan, np.inf)
+    detector = DetectorFugas(1) if tramo_vigilado(sistema.sensores) else None
+    t_alarma = math.nan
+    volumen = 0.0
+    flujo_max = 0.0
+
+    duracion = corrida["duracion"]
+    while ejecucion.t < duracion:
+        flujos = ejecucion.paso(duracion)
+        flujo_total = flujos["flujo_total"]
+        volumen += flujo_total * sistema.ultimo_dt
+        flujo_max = max(flujo_max, flujo_total)
+        nivel = np.array([t.nivel_actual for t in tanques])
+        t_llenado = np.where(np.isinf(t_llenado) & (nivel >= LLENO * capacidad), ejecucion.t, t_llenado)
+        t_vaciado = np.where(np.isinf(t_vaciado) & (nivel <= VACIO * capacidad), ejecucion.t, t_vaciado)
+        if detector is not None and math.isnan(t_alarma):
+            arriba, abajo, con_flujo = muestra(sistema, flujos)
+            if detector.actualizar(ejecucion.t, np.array([arriba]), np.array([abajo]), np.array([con_flujo])):
+                t_alarma = ejecucion.t
+
+    resumen: Dict[str, Any] = {}
+    for i, (tanque_id, t) in enumerate(sistema.tanques.items()):
+        # Vacío en el CSV: el tanque no empezó en condición de medirlo o no llegó en la duración
+        resumen[f"t_llenado.{tanque_id}"] = None if not np.isfinite(t_llenado[i]) else round(float(t_llenado[i]), 1)
+        resumen[f"t_vaciado.{tanque_id}"] = None if not np.isfinite(t_vaciado[i]) else round(float(t_vaciado[i]), 1)
+        resumen[f"nivel_final.{tanque_id}"] = round(t.nivel_actual, 1)
+    resumen.update({
+        "flujo_medio": round(volumen / ejecucion.t, 3) if ejecucion.t else 0.0,
+        "flujo_max": round(flujo_max, 3),
+        "t_alarma_fuga": None if math.isnan(t_alarma) else round(t_alarma, 1),
+        "ticks": ejecucion.ticks,
+        "t_simulado": round(ejecucion.t, 1),
+        "segundos": round(time.perf_counter() - inicio, 3),
+    })
+    return resumen
+
+
+def _iniciar_proceso():
+    # Ctrl+C lo maneja el proceso principal, que termina el pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _corrida_en_pool(corrida: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]], Optional[str]]:
+    # Un error en una corrida no corta el barrido: vuelve como texto junto con la corrida
+    try:
+        return corrida, ejecutar_corrida(corrida), None
+    except Exception as e:
+        return corrida, None, f"{type(e).__name__}: {e}"
+
+
+def corridas(escenario: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Producto cartesiano parámetros x líneas de tiempo x semillas; cada corrida con un id estable"""
+    parametros: Dict[str, List[Any]] = escenario.get("parametros", {})
+    lineas = escenario.get("lineas_tiempo") or {"sin_eventos": []}
+    semillas = escenario.get("semillas", [0])
+    nombres = list(parametros)
+    with open(escenario.get("topologia") or TOPOLOGIA_POR_DEFECTO, encoding="utf-8") as f:
+        topologia = json.load(f)
+    ajustes = {
+        "duracion": float(escenario.get("duracion", 3600.0)),
+        "dt": float(escenario.get("dt", 2.0)),
+        "adaptativo": bool(escenario.get("adaptativo", True)),
+        "dt_max": float(escenario.get("dt_max", 3600.0)),
+    }
+    lista = []
+    for valores in itertools.product(*(parametros[n] for n in nombres)):
+        for linea, eventos in lineas.items():
+            if isinstance(eventos, str):
+                eventos = cargar_linea_tiempo(eventos)
+            for semilla in semillas:
+                combinacion = {"parametros": dict(zip(nombres, valores)), "linea_tiempo": linea, "semilla": semilla}
+                eventos = sorted(eventos, key=lambda e: e["t"])
+                # El id cubre todo lo que define el resultado (eventos, ajustes y contenido de la topología):
+                # al reanudar no cambia con el orden del archivo, y una corrida con otra configuración no
+                # se confunde con una ya hecha
+                clave = json.dumps(
+                    {**combinacion, **ajustes, "eventos": eventos, "topologia": topologia}, sort_keys=True
+                )
+                lista.append({
+                    **combinacion,
+                    **ajustes,
+                    "id": hashlib.sha1(clave.encode()).hexdigest()[:12],
+                    "eventos": eventos,
+                    "topologia": escenario.get("topologia"),
+                })
+    return lista
+
+
+def _reparar_cola(ruta: str):
+    """Descarta una última línea a medias (corte durante la escritura) antes de reanudar"""
+    with open(ruta, "rb+") as f:
+        datos = f.read()
+        if datos and not datos.endswith(b"\n"):
+            f.truncate(datos.rfind(b"\n") + 1)
+
+
+def completadas(ruta: str, columnas: List[str]) -> Set[str]:
+    """Ids ya presentes en el archivo de resultados"""
+    if not os.path.exists(ruta):
+        return set()
+    _reparar_cola(ruta)
+    with open(ruta, newline="", encoding="utf-8") as f:
+        if ruta.endswith(".jsonl"):
+            ids = set()
+            for linea in f:
+                if not linea.strip():
+                    continue
+                fila = json.loads(linea)
+                if set(fila) != set(columnas):
+                    raise ValueError(f"{ruta} tiene otras columnas: es de otro barrido")
+                ids.add(fila["corrida"])
+            return ids
+        lector = csv.reader(f)
+        encabezado = next(lector, None)
+        if encabezado is None:
+            return set()
+        if encabezado != columnas:
+            raise ValueError(f"{ruta} tiene otras columnas: es de otro barrido")
+        return {fila[0] for fila in lector}
+
+
+class SalidaResultados:
+    """Agrega una fila por corrida terminada (CSV o JSONL) y la deja en disco enseguida"""
+
+    def __init__(self, ruta: str, columnas: List[str]):
+        self.columnas = columnas
+        self.jsonl = ruta.endswith(".jsonl")
+        nuevo = not os.path.exists(ruta) or os.path.getsize(ruta) == 0
+        self._archivo = open(ruta, "a", newline="", encoding="utf-8")
+        self._writer = None if self.jsonl else csv.writer(self._archivo)
+        if nuevo and not self.jsonl:
+            self._writer.writerow(columnas)
+
+    def escribir(self, fila: Dict[str, Any]):
+        if self.jsonl:
+            self._archivo.write(json.dumps(fila) + "\n")
+        else:
+            self._writer.writerow(["" if fila.get(c) is None else fila.get(c) for c in self.columnas])
+        self._archivo.flush()
+
+    def cerrar(self):
+        self._archivo.close()
+
+
+def _duracion(segundos: float) -> str:
+    minutos, segundos = divmod(int(segundos), 60)
+    return f"{minutos}m{segundos:02d}s" if minutos else f"{segundos}s"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Barrido de escenarios en paralelo (sin broker)")
+    parser.add_argument("escenario", help="JSON con parametros, lineas_tiempo, semillas, duracion, ...")
+    parser.add_argument("--salida", default="resultados.csv", help="Archivo de resultados (.csv o .jsonl)")
+    parser.add_argument("--procesos", type=int, help="Procesos del pool (por defecto, uno por núcleo)")
+    args = parser.parse_args()
+
+    with open(args.escenario, encoding="utf-8") as f:
+        escenario = json.load(f)
+    topologia = cargar_topologia(escenario.get("topologia"))
+    parametros = list(escenario.get("parametros", {}))
+    try:
+        for nombre in parametros:
+            validar_parametro(topologia, nombre)
+    except ValueError as e:
+        parser.error(str(e))
+    columnas = ["corrida", "linea_tiempo", "semilla"] + parametros + columnas_resumen(topologia)
+
+    todas = corridas(escenario)
+    try:
+        hechas = completadas(args.salida, columnas)
+    except ValueError as e:
+        parser.error(str(e))
+    pendientes = [c for c in todas if c["id"] not in hechas]
+    ajenas = len(hechas - {c["id"] for c in todas})
+    print(
+        f"🧪 {len(todas)} corridas ({len(hechas) - ajenas} ya en {args.salida}), "
+        f"{len(pendientes)} pendientes"
+    )
+    if ajenas:
+        print(f"⚠️  {ajenas} filas de {args.salida} no son de este escenario (otra configuración o combinación quitada)")
+    if not pendientes:
+        return
+
+    salida = SalidaResultados(args.salida, columnas)
+    inicio = time.perf_counter()
+    terminadas = fallidas = 0
+    pool = mp.Pool(args.procesos, initializer=_iniciar_proceso)
+    try:
+        # Los resultados llegan en orden de finalización y se escriben al llegar
+        for corrida, resumen, error in pool.imap_unordered(_corrida_en_pool, pendientes):
+            if error is not None:
+                # No se escribe: la próxima ejecución la reintenta
+                fallidas += 1
+                print(f"❌ Corrida {corrida['id']} ({corrida['parametros']}): {error}")
+                continue
+            salida.escribir({
+                "corrida": corrida["id"],
+                "linea_tiempo": corrida["linea_tiempo"],
+                "semilla": corrida["semilla"],
+                **corrida["parametros"],
+                **resumen,
+            })
+            terminadas += 1
+            transcurrido = time.perf_counter() - inicio
+            restantes = len(pendientes) - terminadas - fallidas
+            print(
+                f"✅ [{terminadas + fallidas}/{len(pendientes)}] {corrida['linea_tiempo']} "
+                f"{corrida['parametros']} semilla={corrida['semilla']} "
+                f"— ETA {_duracion(transcurrido / (terminadas + fallidas) * restantes)}"
+            )
+    except KeyboardInterrupt:
+        print(f"🛑 Interrumpido: {terminadas} corridas guardadas, el resto se retoma al volver a ejecutar")
+        pool.terminate()
+        raise SystemExit(130)
+    finally:
+        salida.cerrar()
+    pool.close()
+    pool.join()
+    print(f"🏁 {terminadas} corridas en {_duracion(time.perf_counter() - inicio)} → {args.salida}")
+    if fallidas:
+        print(f"⚠️  {fallidas} corridas fallidas (se reintentan al volver a ejecutar)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Callable, Dict, Any, List
+
+from mqtt_simulator import SistemaSimulacion, MQTTManager
+from topologia import malla
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+# Ticks entre restauraciones de niveles en el caso de la malla (ver benchmarks())
+REINICIO_MALLA = 1000
+
+
+class BrokerLocal:
+    """Sustituto del cliente paho: acepta publish() y solo cuenta mensajes y bytes"""
+
+    def __init__(self):
+        self.mensajes = 0
+        self.bytes = 0
+
+    def publish(self, topico: str, mensaje, qos: int = 0, retain: bool = False):
+        self.mensajes += 1
+        self.bytes += len(mensaje)
+
+
+def sistema_con_valvulas(*abiertas: int, fuga: bool = False, semilla: int = 42) -> SistemaSimulacion:
+    sistema = SistemaSimulacion(semilla=semilla)
+    for valvula_id in abiertas:
+        sistema.valvulas[valvula_id].estado = True
+    if fuga:
+        sistema.simulando_fuga = True
+        sistema.fuga_intensidad = 5.0
+    return sistema
+
+
+def medir(
+    funcion: Callable[[], Any], iteraciones: int, repeticiones: int = 5, calentamiento: int = 200
+) -> Dict[str, float]:
+    """Ejecuta la función y devuelve ticks/s y percentiles de latencia de la mejor repetición"""
+    for _ in range(calentamiento):
+        funcion()
+    reloj = time.perf_counter_ns
+    mejor = None
+    # La mejor de varias repeticiones filtra el ruido de otros procesos del host
+    for _ in range(repeticiones):
+        muestras: List[int] = []
+        inicio = reloj()
+        for _ in range(iteraciones):
+            t0 = reloj()
+            funcion()
+            muestras.append(reloj() - t0)
+        total = reloj() - inicio
+        if mejor is None or total < mejor[0]:
+            mejor = (total, muestras)
+    total, muestras = mejor
+    muestras.sort()
+    return {
+        "ticks_s": round(iteraciones / (total / 1e9), 1),
+        "p50_us": round(muestras[len(muestras) // 2] / 1000, 2),
+        "p99_us": round(muestras[int(len(muestras) * 0.99)] / 1000, 2),
+    }
+
+
+def benchmarks(semilla: int = 42) -> Dict[str, Callable[[], Any]]:
+    """Casos del benchmark; cada uno es una función sin argumentos que ejecuta un tick"""
+    flujo = sistema_con_valvulas(1, 2, 3, 4, 5, 6, semilla=semilla)
+    solo_v1 = sistema_con_valvulas(1, semilla=semilla)
+    cerrado = sistema_con_valvulas(semilla=semilla)
+    con_fuga = sistema_con_valvulas(1, 2, 3, 5, fuga=True, semilla=semilla)
+
+    # actualizar_sistema mueve los niveles: se reinicia al vaciarse para quedarse en la rama con flujo.
+    # Se decide con los flujos del tick anterior: un calcular_flujos() extra duplicaría el trabajo medido
+    estado = {"sistema": sistema_con_valvulas(1, 2, 3, 5, semilla=semilla), "flujo_total": None}
+
+    def actualizar_sistema():
+        if estado["flujo_total"] == 0:
+            estado["sistema"] = sistema_con_valvulas(1, 2, 3, 5, semilla=semilla)
+        flujos = estado["sistema"].actualizar_sistema()
+        estado["flujo_total"] = flujos["flujo_total"]
+        return flujos
+
+    datos_sistema = sistema_con_valvulas(1, 2, 3, 5, semilla=semilla)
+    flujos = datos_sistema.actualizar_sistema()
+
+    # Extremo a extremo: comandos + tick + payload + publicación JSON contra el broker local
+    e2e = sistema_con_valvulas(1, 2, 3, 5, semilla=semilla)
+    manager = MQTTManager(e2e)
+    manager.client = BrokerLocal()
+
+    def publicar():
+        manager.comandos.aplicar(e2e, 0)
+        manager.publicar_datos(e2e.get_datos_mqtt(e2e.actualizar_sistema()))
+
+    # Motor de grafo sobre una malla de 484 uniones con lazos. Hacia los 3500 ticks los niveles se
+    # igualan y el gradiente conjugado arranca ya convergido (0 iteraciones): se restauran los niveles
+    # iniciales cada REINICIO_MALLA ticks para medir siempre una resolución real
+    red = SistemaSimulacion(malla(22), semilla)
+    niveles_red = [(t, t.nivel_actual) for t in red.tanques.values()]
+    ticks_red = [0]
+
+    def red_malla():
+        if ticks_red[0] % REINICIO_MALLA == 0:
+            for tanque, nivel in niveles_red:
+                tanque.nivel_actual = nivel
+        ticks_red[0] += 1
+        flujos = red.actualizar_sistema()
+        if red.red.iteraciones == 0:
+            raise RuntimeError("red_malla_22x22: el gradiente conjugado no iteró, el caso no mide el solver")
+        return flujos
+
+    return {
+        "calcular_flujos_flujo_completo": flujo.calcular_flujos,
+        "calcular_flujos_solo_v1": solo_v1.calcular_flujos,
+        "calcular_flujos_cerrado": cerrado.calcular_flujos,
+        "calcular_flujos_fuga": con_fuga.calcular_flujos,
+        "actualizar_sistema": actualizar_sistema,
+        "get_datos_mqtt_json": lambda: json.dumps(datos_sistema.get_datos_mqtt(flujos)),
+        "publicacion_extremo_a_extremo": publicar,
+        "red_malla_22x22": red_malla,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks del núcleo del simulador")
+    parser.add_argument("--iteraciones", type=int, default=10000)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--guardar-baseline", action="store_true", help="Sobrescribir la baseline con esta corrida")
+    parser.add_argument(
+        "--tolerancia", type=float, default=0.25, help="Caída máxima de ticks/s aceptada frente a la baseline"
+    )
+    parser.add_argument("--solo", help="Ejecutar solo los casos que contengan este texto")
+    args = parser.parse_args()
+
+    resultados = {}
+    for nombre, funcion in benchmarks(args.semilla).items():
+        if args.solo and args.solo not in nombre:
+            continue
+        resultados[nombre] = medir(funcion, args.iteraciones, args.repeticiones)
+        resultados[nombre]["iteraciones"] = args.iteraciones
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["resultados"]
+
+    regresiones = []
+    print(f"{'caso':34} {'ticks/s':>12} {'p50 µs':>8} {'p99 µs':>8} {'vs base':>8}")
+    for nombre, r in resultados.items():
+        comparacion = ""
+        if nombre in baseline and baseline[nombre].get("iteraciones") != r["iteraciones"]:
+            # Con otro número de iteraciones el calentamiento pesa distinto: no se compara
+            comparacion = "≠ iter"
+        elif nombre in baseline and not args.guardar_baseline:
+            cambio = r["ticks_s"] / baseline[nombre]["ticks_s"] - 1
+            comparacion = f"{cambio:+.0%}"
+            if cambio < -args.tolerancia:
+                regresiones.append(nombre)
+                comparacion += " ❌"
+        print(f"{nombre:34} {r['ticks_s']:>12,.0f} {r['p50_us']:>8.2f} {r['p99_us']:>8.2f} {comparacion:>8}")
+
+    if args.guardar_baseline:
+        # Solo se reemplazan los casos medidos (permite actualizar uno con --solo)
+        baseline.update(resultados)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(
+                {"semilla": args.semilla, "repeticiones": args.repeticiones, "resultados": baseline},
+                f,
+                indent=2,
+            )
+            f.write("\n")
+        print(f"💾 Baseline guardada en {args.baseline}")
+
+    if regresiones:
+        print(f"⚠️  Regresión de rendimiento (> {args.tolerancia:.0%}): {', '.join(regresiones)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional
+
+log = logging.getLogger("simulador.comandos")
+
+
+@dataclass
+class ComandoPendiente:
+    comando: Dict[str, Any]
+    recibido: float
+    tick_aplicado: Optional[int] = None
+    latencia: float = 0.0  # segundos entre recepción y aplicación
+
+
+class ColaComandos:
+    """Cola acotada entre el hilo de red de paho y el bucle de simulación"""
+
+    def __init__(self, capacidad: int = 1024):
+        self._cola: "queue.Queue[ComandoPendiente]" = queue.Queue(maxsize=capacidad)
+        self.recibidos = 0
+        self.aplicados = 0
+        self.descartados = 0
+        self.latencia_total = 0.0
+        self.latencia_max = 0.0
+        # Despierta al bucle principal cuando llega un comando (pausa sin sondeo)
+        self._hay_comandos = threading.Event()
+
+    def encolar(self, comando: Dict[str, Any]) -> bool:
+        """Encola un comando sin bloquear; devuelve False si la cola está llena"""
+        try:
+            self._cola.put_nowait(ComandoPendiente(comando, time.perf_counter()))
+        except queue.Full:
+            self.descartados += 1
+            return False
+        self.recibidos += 1
+        self._hay_comandos.set()
+        return True
+
+    def esperar(self, timeout: float) -> bool:
+        """Bloquea hasta que llegue un comando o venza el timeout"""
+        hay = self._hay_comandos.wait(timeout)
+        self._hay_comandos.clear()
+        return hay
+
+    def pendientes(self) -> int:
+        return self._cola.qsize()
+
+    def aplicar(self, sistema, tick: int) -> List[ComandoPendiente]:
+        """Aplica en lote los comandos pendientes al inicio del tick indicado"""
+        aplicados = []
+        # Solo lo que ya estaba encolado: lo que llegue durante el lote espera al siguiente tick
+        for _ in range(self._cola.qsize()):
+            try:
+                pendiente = self._cola.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                reconocido = sistema.aplicar_comando(pendiente.comando)
+            except Exception as e:
+                log.error("❌ Error procesando comando: %s", e)
+                continue
+            if not reconocido:
+                log.warning("⚠️  Comando desconocido: %s", pendiente.comando)
+                continue
+            pendiente.tick_aplicado = tick
+            pendiente.latencia = time.perf_counter() - pendiente.recibido
+            self.aplicados += 1
+            self.latencia_total += pendiente.latencia
+            self.latencia_max = max(self.latencia_max, pendiente.latencia)
+            aplicados.append(pendiente)
+        return aplicados
+
+    def latencia_media(self) -> float:
+        return self.latencia_total / self.aplicados if self.aplicados else 0.0
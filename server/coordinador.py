@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import logging
+import multiprocessing as mp
+import os
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+import paho.mqtt.client as mqtt
+from paho.mqtt.client import CallbackAPIVersion
+
+from cola_comandos import ColaComandos
+from flota import FlotaSimulacion
+from mqtt_simulator import PERIODO_MAXIMO, periodo_valido
+from registro import configurar_registro
+
+log = logging.getLogger("simulador.coordinador")
+
+
+TOPICO_CONTROL = "plantas/control"
+TOPICO_STATS = "plantas/stats"
+
+# Estado de cada planta en la memoria compartida; los campos se llaman como los atributos de FlotaSimulacion
+ESTADO = np.dtype([
+    ("capacidad", np.float64, 4),
+    ("nivel", np.float64, 4),
+    ("valvula_estado", np.bool_, 6),
+    ("valvula_presion", np.float64, 6),
+    ("sensores", np.float64, 4),
+    ("simulando_fuga", np.bool_),
+    ("fuga_intensidad", np.float64),
+    ("flujo_base", np.float64),
+    ("flujo_total", np.float64),
+])
+
+# Un tick que tarda más que esto se considera un proceso caído
+TIMEOUT_BARRERA = 60.0
+
+
+def fragmentos(n_plantas: int, procesos: int) -> List[range]:
+    """Reparte las plantas en rangos contiguos, uno por proceso"""
+    limites = np.linspace(0, n_plantas, procesos + 1).astype(int)
+    return [range(a, b) for a, b in zip(limites[:-1], limites[1:])]
+
+
+def volcar(flota: FlotaSimulacion, estado: np.ndarray):
+    """Copia el estado de la flota a su tramo de la memoria compartida"""
+    for campo in ESTADO.names:
+        estado[campo] = getattr(flota, campo)
+
+
+def cargar(flota: FlotaSimulacion, estado: np.ndarray):
+    """Carga en la flota el estado de su tramo de la memoria compartida"""
+    for campo in ESTADO.names:
+        getattr(flota, campo)[...] = estado[campo]
+
+
+class _Fragmento:
+    """Adapta una FlotaSimulacion a ColaComandos: cada comando lleva su planta local en "_planta" """
+
+    def __init__(self, flota: FlotaSimulacion):
+        self.flota = flota
+
+    def aplicar_comando(self, comando: Dict[str, Any]) -> bool:
+        comando = dict(comando)
+        return self.flota.aplicar_comando(comando.pop("_planta"), comando)
+
+
+def _trabajador(indice: int, plantas: range, n_total: int, memoria_nombre: str, barrera, detener, config):
+    """Proceso de un fragmento: avanza sus plantas un tick por apertura de la barrera y las publica"""
+    listener = configurar_registro(config["log_nivel"], config["log_formato"])
+    memoria = shared_memory.SharedMemory(name=memoria_nombre)
+    client = None
+    try:
+        estado = np.ndarray(n_total, ESTADO, buffer=memoria.buf)[plantas.start:plantas.stop]
+        flota = FlotaSimulacion(len(plantas), config["semilla"], plantas.start)
+        if config["restaurado"]:
+            cargar(flota, estado)
+            # El ruido sigue donde quedó: misma semilla y la posición de la instantánea
+            flota.ruido.saltar(config["ruido_ticks"])
+        else:
+            volcar(flota, estado)
+
+        cola = ColaComandos()
+        fragmento = _Fragmento(flota)
+        if config["publicar"]:
+            client = mqtt.Client(callback_api_version=CallbackAPIVersion.VERSION1)
+
+            def on_connect(client, userdata, flags, rc):
+                if rc == 0:
+                    # Cada proceso recibe todos los comandos y se queda con los de sus plantas
+                    client.subscribe("plantas/+/comandos")
+                else:
+                    log.error("❌ Error MQTT (proceso %d): %s", indice, rc)
+
+            def on_message(client, userdata, msg):
+                try:
+                    planta = int(msg.topic.split("/")[1])
+                except ValueError:
+                    return
+                if planta not in plantas:
+                    return
+                try:
+                    comando = json.loads(msg.payload.decode())
+                    comando["_planta"] = planta - plantas.start
+                    if not cola.encolar(comando):
+                        log.warning("⚠️  Cola de comandos llena, descartado: %s", comando)
+                except Exception as e:
+                    log.error("❌ Error procesando comando: %s", e)
+
+            client.on_connect = on_connect
+            client.on_message = on_message
+            client.connect(config["host"], config["puerto"], 60)
+            client.loop_start()
+        log.info("⚙️  Proceso %d: plantas %d-%d", indice, plantas.start, plantas.stop - 1)
+        # Listo: el coordinador no empieza a contar ticks hasta que arrancaron todos
+        barrera.wait()
+
+        tick = 0
+        while True:
+            barrera.wait()
+            if detener.is_set():
+                break
+            cola.aplicar(fragmento, tick)
+            flota.actualizar_sistema()
+            volcar(flota, estado)
+            if client is not None:
+                for i in range(flota.n):
+                    client.publish(f"plantas/{plantas.start + i}/datos", json.dumps(flota.get_datos_mqtt(i)))
+            tick += 1
+            barrera.wait()
+    except Exception:
+        log.exception("❌ Proceso %d detenido por error", indice)
+        # Rompe la barrera: el coordinador lo detecta enseguida en lugar de esperar el timeout
+        barrera.abort()
+    finally:
+        if client is not None:
+            client.disconnect()
+            client.loop_stop()
+        estado = None
+        memoria.close()
+        listener.stop()
+
+
+class Coordinador:
+    """Reparte N plantas entre procesos (un fragmento vectorizado por núcleo) y los avanza en lockstep.
+
+    El estado de todas las plantas vive en memoria compartida: los procesos lo vuelcan al final de
+    cada tick y el coordinador lo lee entre ticks, sin mensajes, para instantáneas y agregados."""
+
+    def __init__(
+        self,
+        n_plantas: int,
+        procesos: Optional[int] = None,
+        semilla: Optional[int] = None,
+        host: str = "localhost",
+        puerto: int = 1883,
+        publicar: bool = True,
+        restaurar: Optional[str] = None,
+        instantanea: Optional[str] = None,
+        log_nivel: str = "INFO",
+        log_formato: str = "texto",
+    ):
+        self.n = n_plantas
+        self.procesos = max(1, min(procesos or os.cpu_count() or 1, n_plantas))
+        # Sin semilla se sortea una y se comparte: todos los procesos derivan sus plantas de la misma raíz
+        self.semilla = semilla if semilla is not None else np.random.SeedSequence().entropy
+        self.semilla_explicita = semilla is not None
+        self.host = host
+        self.puerto = puerto
+        self.publicar = publicar
+        self.restaurar = restaurar
+        # Archivo del comando instantanea (no se acepta una ruta por MQTT)
+        self.ruta_instantanea = instantanea
+        self.log_config = (log_nivel, log_formato)
+
+        self.tick = 0
+        # Ticks de ruido consumidos desde la semilla (uno por tick, también a través de restauraciones)
+        self.ruido_ticks = 0
+        self.periodo = 2.0
+        self.pausado = False
+        self.pasos_pendientes = 0
+        self.terminar = False
+        self.comandos = ColaComandos()
+        self.client: Optional[mqtt.Client] = None
+        self._memoria: Optional[shared_memory.SharedMemory] = None
+        self.estado: Optional[np.ndarray] = None
+        self._workers: List[mp.Process] = []
+
+    def iniciar(self):
+        """Crea la memoria compartida, carga la instantánea (si hay) y lanza los procesos"""
+        self._memoria = shared_memory.SharedMemory(create=True, size=max(1, self.n * ESTADO.itemsize))
+        self.estado = np.ndarray(self.n, ESTADO, buffer=self._memoria.buf)
+        if self.restaurar:
+            with np.load(self.restaurar) as instantanea:
+                if len(instantanea["estado"]) != self.n:
+                    raise ValueError(
+                        f"La instantánea tiene {len(instantanea['estado'])} plantas, no {self.n}"
+                    )
+                self.estado[:] = instantanea["estado"]
+                self.tick = int(instantanea["tick"])
+                # Instantáneas anteriores sin ruido_ticks: el ruido avanza uno por tick
+                self.ruido_ticks = int(instantanea["ruido_ticks"]) if "ruido_ticks" in instantanea else self.tick
+                semilla = int(str(instantanea["semilla"]))
+            if semilla != self.semilla and self.semilla_explicita:
+                log.warning("⚠️  Se usa la semilla de la instantánea (%d), no --semilla %d", semilla, self.semilla)
+            self.semilla = semilla
+            log.info("📂 Estado restaurado de %s (tick %d)", self.restaurar, self.tick)
+
+        # spawn: los procesos no heredan hilos ni sockets del coordinador
+        ctx = mp.get_context("spawn")
+        self._barrera = ctx.Barrier(self.procesos + 1)
+        self._detener = ctx.Event()
+        config = {
+            "semilla": self.semilla,
+            "restaurado": bool(self.restaurar),
+            "ruido_ticks": self.ruido_ticks,
+            "publicar": self.publicar,
+            "host": self.host,
+            "puerto": self.puerto,
+            "log_nivel": self.log_config[0],
+            "log_formato": self.log_config[1],
+        }
+        for i, plantas in enumerate(fragmentos(self.n, self.procesos)):
+            worker = ctx.Process(
+                target=_trabajador,
+                args=(i, plantas, self.n, self._memoria.name, self._barrera, self._detener, config),
+                name=f"fragmento-{i}",
+                daemon=True,
+            )
+            worker.start()
+            self._workers.append(worker)
+        self._barrera.wait(TIMEOUT_BARRERA)
+
+        if self.publicar:
+            self.client = mqtt.Client(callback_api_version=CallbackAPIVersion.VERSION1)
+            self.client.on_connect = self.on_connect
+            self.client.on_message = self.on_message
+            self.client.connect(self.host, self.puerto, 60)
+            self.client.loop_start()
+        log.info("🚀 %d plantas en %d procesos (semilla %d)", self.n, self.procesos, self.semilla)
+
+    def on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            client.subscribe(TOPICO_CONTROL)
+            log.info("🎛️  Control global en %s", TOPICO_CONTROL)
+        else:
+            log.error("❌ Error MQTT: %s", rc)
+
+    def on_message(self, client, userdata, msg):
+        try:
+            if not self.comandos.encolar(json.loads(msg.payload.decode())):
+                log.warning("⚠️  Cola de control llena")
+        except Exception as e:
+            log.error("❌ Error procesando comando: %s", e)
+
+    def aplicar_comando(self, comando: Dict[str, Any]) -> bool:
+        """Comandos globales: pausar/reanudar/paso/periodo/instantanea/detener"""
+        nombre = comando.get("comando")
+        if nombre == "pausar":
+            valor = comando.get("valor")
+            self.pausado = (not self.pausado) if valor is None else bool(valor)
+            self.pasos_pendientes = 0
+            log.info("🔄 Flota %s", "PAUSADA" if self.pausado else "REANUDADA")
+        elif nombre == "reanudar":
+            self.pausado = False
+            self.pasos_pendientes = 0
+            log.info("🔄 Flota REANUDADA")
+        elif nombre == "paso":
+            self.pasos_pendientes += max(1, int(comando.get("n", 1)))
+        elif nombre == "periodo":
+            periodo = float(comando.get("valor"))
+            # Mismo criterio que el simulador en vivo (el 0 de --periodo para medir throughput solo
+            # se acepta al arrancar)
+            if not periodo_valido(periodo):
+                log.warning("⚠️  Periodo inválido: %s (debe estar entre 0 y %s s)", periodo, PERIODO_MAXIMO)
+            else:
+                self.periodo = periodo
+                log.info("⏱️  Periodo de la flota: %ss por tick", periodo)
+        elif nombre == "instantanea":
+            if self.ruta_instantanea:
+                self.instantanea(self.ruta_instantanea)
+            else:
+                log.warning("⚠️  Sin archivo de instantáneas configurado (--instantanea)")
+        elif nombre == "detener":
+            self.terminar = True
+        else:
+            return False
+        return True
+
+    def avanzar(self) -> float:
+        """Un tick en todos los procesos: abre la barrera y espera a que terminen; devuelve la duración"""
+        inicio = time.perf_counter()
+        self._barrera.wait(TIMEOUT_BARRERA)
+        self._barrera.wait(TIMEOUT_BARRERA)
+        self.tick += 1
+        self.ruido_ticks += 1
+        return time.perf_counter() - inicio
+
+    def instantanea(self, ruta: str):
+        """Escribe el estado de todas las plantas; solo entre ticks (los procesos esperan en la barrera)"""
+        # Escritura atómica: un lector nunca ve un archivo a medias
+        temporal = f"{ruta}.tmp"
+        with open(temporal, "wb") as f:
+            # Semilla (entero de 128 bits: como texto) y posición del ruido para continuar la secuencia
+            np.savez(
+                f, estado=self.estado, tick=self.tick, semilla=str(self.semilla), ruido_ticks=self.ruido_ticks
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, ruta)
+        log.info("📸 Instantánea de %d plantas en %s (tick %d)", self.n, ruta, self.tick)
+
+    def resumen(self, duracion: float) -> Dict[str, Any]:
+        return {
+            "tick": self.tick,
+            "plantas": self.n,
+            "procesos": self.procesos,
+            "ms_tick": round(duracion * 1000, 2),
+            "plantas_tick_s": round(self.n / duracion) if duracion > 0 else None,
+            # Agregado leído de la memoria compartida, sin pedir nada a los procesos
+            "flujo_total": round(float(self.estado["flujo_total"].sum()), 2),
+            "fugas": int(self.estado["simulando_fuga"].sum()),
+        }
+
+    def ejecutar(self, ticks: Optional[int] = None, periodo: float = 2.0, stats_cada: int = 10):
+        """Avanza la flota cada `periodo` segundos (0: tan rápido como se pueda) hasta `ticks` o detener"""
+        self.periodo = periodo
+        ejecutados = 0
+        while not self.terminar and (ticks is None or ejecutados < ticks):
+            inicio = time.perf_counter()
+            self.comandos.aplicar(self, self.tick)
+            if self.pausado and self.pasos_pendientes == 0:
+                self.comandos.esperar(0.5)
+                continue
+            if self.pausado:
+                self.pasos_pendientes -= 1
+
+            duracion = self.avanzar()
+            ejecutados += 1
+            if stats_cada and self.tick % stats_cada == 0:
+                resumen = self.resumen(duracion)
+                log.info(
+                    "📊 Tick %d: %d plantas en %d procesos, %.1f ms/tick, %s plantas-tick/s",
+                    self.tick,
+                    self.n,
+                    self.procesos,
+                    resumen["ms_tick"],
+                    f"{resumen['plantas_tick_s']:,}",
+                )
+                if self.client is not None:
+                    self.client.publish(TOPICO_STATS, json.dumps(resumen))
+            # Un comando de control acorta la espera (el tick siguiente lo aplica)
+            restante = self.periodo - (time.perf_counter() - inicio)
+            if restante > 0:
+                self.comandos.esperar(restante)
+
+    def detener(self):
+        """Libera a los procesos con la orden de salir, espera su fin y libera la memoria compartida"""
+        if self._workers:
+            self._detener.set()
+            try:
+                self._barrera.wait(5.0)
+            except threading.BrokenBarrierError:
+                pass
+            for worker in self._workers:
+                worker.join(5.0)
+                if worker.is_alive():
+                    worker.terminate()
+            self._workers = []
+        if self.client is not None:
+            self.client.disconnect()
+            self.client.loop_stop()
+        if self._memoria is not None:
+            self.estado = None
+            self._memoria.close()
+            self._memoria.unlink()
+            self._memoria = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulación de una flota repartida entre procesos")
+    parser.add_argument("--plantas", type=int, default=10000)
+    parser.add_argument("--procesos", type=int, help="Procesos (por defecto, uno por núcleo)")
+    parser.add_argument("--periodo", type=float, default=2.0, help="Segundos reales entre ticks (0: sin espera)")
+    parser.add_argument("--ticks", type=int, help="Terminar tras N ticks")
+    parser.add_argument("--semilla", type=int)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--puerto", type=int, default=1883)
+    parser.add_argument("--sin-mqtt", action="store_true", help="No conectar al broker (medir throughput)")
+    parser.add_argument("--restaurar", metavar="ARCHIVO", help="Arrancar desde una instantánea .npz")
+    parser.add_argument(
+        "--instantanea", metavar="ARCHIVO", help="Archivo de instantáneas: comando instantanea y al terminar"
+    )
+    parser.add_argument("--stats-cada", type=int, default=10, metavar="N")
+    parser.add_argument("--log-nivel", default="INFO")
+    parser.add_argument("--log-formato", choices=["texto", "jsonl"], default="texto")
+    args = parser.parse_args()
+
+    listener = configurar_registro(args.log_nivel, args.log_formato)
+    coordinador = Coordinador(
+        args.plantas,
+        args.procesos,
+        args.semilla,
+        args.host,
+        args.puerto,
+        publicar=not args.sin_mqtt,
+        restaurar=args.restaurar,
+        instantanea=args.instantanea,
+        log_nivel=args.log_nivel,
+        log_formato=args.log_formato,
+    )
+    try:
+        coordinador.iniciar()
+        inicio = time.perf_counter()
+        tick_inicial = coordinador.tick
+        coordinador.ejecutar(args.ticks, args.periodo, args.stats_cada)
+        ticks = coordinador.tick - tick_inicial
+        duracion = time.perf_counter() - inicio
+        if ticks:
+            log.info(
+                "🏁 %d ticks en %.2f s: %s plantas-tick/s",
+                ticks,
+                duracion,
+                f"{args.plantas * ticks / duracion:,.0f}",
+            )
+        if args.instantanea:
+            coordinador.instantanea(args.instantanea)
+    except KeyboardInterrupt:
+        log.info("🛑 Coordinador detenido")
+    except threading.BrokenBarrierError:
+        log.error("❌ Un proceso de la flota dejó de responder")
+    finally:
+        coordinador.detener()
+        listener.stop()
+
+
+if __name__ == "__main__":
+    main()
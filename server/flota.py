@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+
+import argparse
+import time
+from typing import Dict, Any, List, Optional, Sequence
+
+import numpy as np
+
+from detector_fugas import DetectorFugas
+from mqtt_simulator import NIVEL_MINIMO_SALIDA, SistemaSimulacion
+from ruido import RuidoFlota
+
+
+# Orden de columnas del layout de 4 tanques / 6 válvulas / 4 sensores
+TANQUES = ("tanque_izq_1", "tanque_izq_2", "tanque_der_1", "tanque_der_2")
+VALVULAS = (1, 2, 3, 4, 5, 6)
+SENSORES = ("sensor_pre_v1", "sensor_post_v1", "sensor_pre_v2", "sensor_post_v2")
+
+# Ruido por planta y tick: hasta 4 valores para sensores + 2 para válvulas 1 y 2
+SLOTS_RUIDO = 6
+
+
+def _uniform(u: np.ndarray, a: float, b: float) -> np.ndarray:
+    """Escala valores U[0, 1) al rango [a, b) igual que random.uniform"""
+    return a + (b - a) * u
+
+
+class FlotaSimulacion:
+    """N plantas de 4 tanques como estructura de arreglos, avanzadas en bloque con NumPy"""
+
+    def __init__(self, n_plantas: int, semilla: Optional[int] = None, primera: int = 0):
+        self.n = n_plantas
+        # Índice global de la primera planta (fragmentos de una flota repartida entre procesos)
+        self.primera = primera
+
+        # Tanques: izquierdos llenos, derechos vacíos (igual que SistemaSimulacion)
+        self.capacidad = np.full((n_plantas, 4), 1000.0)
+        self.nivel = np.zeros((n_plantas, 4))
+        self.nivel[:, :2] = 1000.0
+        self.flujo_entrada = np.zeros((n_plantas, 4))
+        self.flujo_salida = np.zeros((n_plantas, 4))
+
+        # Válvulas: columna i corresponde a la válvula i + 1
+        self.valvula_estado = np.zeros((n_plantas, 6), dtype=bool)
+        self.valvula_presion = np.zeros((n_plantas, 6))
+        self.valvula_presion[:, :2] = 3.0
+        self.valvula_presion[:, 2:] = 2.0
+
+        self.sensores = np.zeros((n_plantas, 4))
+
+        self.simulando_fuga = np.zeros(n_plantas, dtype=bool)
+        self.fuga_intensidad = np.zeros(n_plantas)
+
+        self.flujo_base = np.full(n_plantas, 3.0)
+        self.flujo_total = np.zeros(n_plantas)
+
+        # Un flujo de ruido por planta: la planta i es reproducible sea cual sea el tamaño de la flota
+        self.ruido = RuidoFlota(semilla, n_plantas, SLOTS_RUIDO, desde=primera)
+
+    @classmethod
+    def desde_sistemas(cls, sistemas: Sequence[SistemaSimulacion], semilla: Optional[int] = None):
+        """Construye una flota copiando el estado de instancias escalares"""
+        flota = cls(len(sistemas), semilla)
+        for i, sistema in enumerate(sistemas):
+            for j, clave in enumerate(TANQUES):
+                tanque = sistema.tanques[clave]
+                flota.capacidad[i, j] = tanque.capacidad
+                flota.nivel[i, j] = tanque.nivel_actual
+                flota.flujo_entrada[i, j] = tanque.flujo_entrada
+                flota.flujo_salida[i, j] = tanque.flujo_salida
+            for j, valvula_id in enumerate(VALVULAS):
+                flota.valvula_estado[i, j] = sistema.valvulas[valvula_id].estado
+                flota.valvula_presion[i, j] = sistema.valvulas[valvula_id].presion
+            for j, clave in enumerate(SENSORES):
+                flota.sensores[i, j] = sistema.sensores[clave]["presion"]
+            flota.simulando_fuga[i] = sistema.simulando_fuga
+            flota.fuga_intensidad[i] = sistema.fuga_intensidad
+            flota.flujo_base[i] = sistema.flujo_base
+        return flota
+
+    def calcular_flujos(self, u: np.ndarray) -> np.ndarray:
+        """Versión enmascarada de SistemaSimulacion.calcular_flujos para todas las plantas"""
+        nivel = self.nivel
+        estado = self.valvula_estado
+        izq1, izq2, der1, der2 = nivel[:, 0], nivel[:, 1], nivel[:, 2], nivel[:, 3]
+
+        # Resetear flujos (los izquierdos nunca reciben, los derechos nunca entregan)
+        self.flujo_salida[:, :2] = 0.0
+        self.flujo_entrada[:, 2:] = 0.0
+
+        presion_base_tuberia = ((izq1 + izq2) / 2000) * 120 + 30
+
+        principales = estado[:, 0] & estado[:, 1]
+        puede_salir_izq1 = estado[:, 2] & (izq1 > NIVEL_MINIMO_SALIDA)
+        puede_salir_izq2 = estado[:, 3] & (izq2 > NIVEL_MINIMO_SALIDA)
+        puede_entrar_der1 = estado[:, 4]
+        puede_entrar_der2 = estado[:, 5]
+        con_flujo = (
+            principales
+            & (puede_salir_izq1 | puede_salir_izq2)
+            & (puede_entrar_der1 | puede_entrar_der2)
+        )
+
+        espacio_der1 = np.where(puede_entrar_der1, self.capacidad[:, 2] - der1, 0.0)
+        espacio_der2 = np.where(puede_entrar_der2, self.capacidad[:, 3] - der2, 0.0)
+        espacio_total = espacio_der1 + espacio_der2
+
+        liquido_izq1 = np.where(puede_salir_izq1, np.maximum(0.0, izq1 - 2), 0.0)
+        liquido_izq2 = np.where(puede_salir_izq2, np.maximum(0.0, izq2 - 2), 0.0)
+        total_liquido = liquido_izq1 + liquido_izq2
+
+        flujo_total = np.minimum(
+            np.minimum(
+                (self.flujo_base * 1.2) * (total_liquido / 1000) + 2.0,
+                espacio_total / 2.0,
+            ),
+            total_liquido / 2.0,
+        )
+        activo = con_flujo & (espacio_total > 1.0) & (total_liquido > 0) & (flujo_total > 0)
+        flujo_total = np.where(activo, flujo_total, 0.0)
+
+        # Distribución proporcional; las plantas inactivas quedan en 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.flujo_entrada[:, 2] = np.where(activo, flujo_total * (espacio_der1 / espacio_total), 0.0)
+            self.flujo_entrada[:, 3] = np.where(activo, flujo_total * (espacio_der2 / espacio_total), 0.0)
+            self.flujo_salida[:, 0] = np.where(activo, flujo_total * (liquido_izq1 / total_liquido), 0.0)
+            self.flujo_salida[:, 1] = np.where(activo, flujo_total * (liquido_izq2 / total_liquido), 0.0)
+
+        # Presiones CON flujo (cadena de pérdidas mínimas, mitad en V2 si hay fuga)
+        pre_v1 = presion_base_tuberia + _uniform(u[:, 0], -2, 2)
+        post_v1 = pre_v1 * 0.98 + _uniform(u[:, 1], -0.5, 0.5)
+        pre_v2 = post_v1 * 0.98 + _uniform(u[:, 2], -0.5, 0.5)
+        post_v2 = pre_v2 * 0.98 + _uniform(u[:, 3], -0.5, 0.5)
+        fuga = self.simulando_fuga
+        pre_v2 = np.where(fuga, pre_v2 * 0.5, pre_v2)
+        post_v2 = np.where(fuga, post_v2 * 0.5, post_v2)
+
+        # Presiones SIN flujo: V1 abierta (acumulación antes de V2) o V1 cerrada
+        v1 = estado[:, 0]
+        v2 = estado[:, 1]
+        sf_pre_v1 = np.where(
+            v1,
+            np.maximum(0.0, presion_base_tuberia * 0.6 + _uniform(u[:, 0], -1, 1)),
+            np.maximum(0.0, presion_base_tuberia * 0.2 + _uniform(u[:, 0], -0.5, 0.5)),
+        )
+        sf_post_v1 = np.where(
+            v1, np.maximum(0.0, presion_base_tuberia * 0.5 + _uniform(u[:, 1], -1, 1)), 0.0
+        )
+        sf_pre_v2 = np.where(
+            v1,
+            np.maximum(
+                0.0,
+                presion_base_tuberia * np.where(v2, 0.3, 0.4) + _uniform(u[:, 2], -1, 1),
+            ),
+            0.0,
+        )
+
+        self.sensores[:, 0] = np.where(con_flujo, pre_v1, sf_pre_v1)
+        self.sensores[:, 1] = np.where(con_flujo, post_v1, sf_post_v1)
+        self.sensores[:, 2] = np.where(con_flujo, pre_v2, sf_pre_v2)
+        self.sensores[:, 3] = np.where(con_flujo, post_v2, 0.0)
+
+        self.flujo_total = flujo_total
+        # Cantidad de valores de ruido consumidos por los sensores en cada rama
+        return np.where(con_flujo, 4, np.where(v1, 3, 1))
+
+    def actualizar_presion(self, columnas: Sequence[int], hay_flujo_real: np.ndarray, u: np.ndarray):
+        """Versión enmascarada de Valvula.actualizar_presion para las columnas indicadas"""
+        for col, u_col in zip(columnas, u.T):
+            estado = self.valvula_estado[:, col]
+            presion = self.valvula_presion[:, col]
+            con_flujo = np.maximum(75.0, np.minimum(85.0, presion + _uniform(u_col, -1.0, 1.0)))
+            estancada = np.maximum(15.0, np.minimum(25.0, presion + _uniform(u_col, -0.3, 0.3)))
+            cerrada = np.maximum(0.0, np.minimum(0.5, _uniform(u_col, 0.0, 0.5)))
+            self.valvula_presion[:, col] = np.where(
+                estado & hay_flujo_real, con_flujo, np.where(estado, estancada, cerrada)
+            )
+
+    def actualizar_nivel(self, dt: float = 2.0):
+        """Versión enmascarada de Tanque.actualizar_nivel para todos los tanques"""
+        espacio_disponible = self.capacidad - self.nivel
+        flujo_entrada_real = np.minimum(self.flujo_entrada, espacio_disponible / dt)
+        cambio = (flujo_entrada_real - self.flujo_salida) * dt
+        self.nivel = np.maximum(0.0, np.minimum(self.capacidad, self.nivel + cambio))
+
+    def actualizar_sistema(self, u: Optional[np.ndarray] = None) -> np.ndarray:
+        """Avanza un tick en todas las plantas; devuelve el flujo total de cada una"""
+        if u is None:
+            u = self.ruido.siguiente()
+
+        consumidos = self.calcular_flujos(u)
+
+        hay_flujo_real = (self.flujo_total > 0) & self.valvula_estado[:, 0] & self.valvula_estado[:, 1]
+        # Las válvulas 1 y 2 toman el ruido que sigue a los sensores, como en la ruta escalar
+        filas = np.arange(self.n)
+        u_valvulas = np.stack([u[filas, consumidos], u[filas, consumidos + 1]], axis=1)
+        self.actualizar_presion((0, 1), hay_flujo_real, u_valvulas)
+
+        self.actualizar_nivel()
+        return self.flujo_total
+
+    def cambiar_valvula(self, plantas, valvula_id: int, nuevo_estado: bool):
+        """Cambia el estado de una válvula en una o varias plantas"""
+        if valvula_id not in VALVULAS:
+            raise ValueError(f"ID de válvula inválido: {valvula_id} (válvulas disponibles: 1-6)")
+        self.valvula_estado[plantas, valvula_id - 1] = nuevo_estado
+
+    def simular_fuga(self, plantas, intensidad: float = 5.0):
+        """Simula una fuga entre post-v1 y pre-v2 en una o varias plantas"""
+        self.simulando_fuga[plantas] = True
+        self.fuga_intensidad[plantas] = intensidad
+
+    def detener_fuga(self, plantas):
+        """Detiene la simulación de fuga en una o varias plantas"""
+        self.simulando_fuga[plantas] = False
+        self.fuga_intensidad[plantas] = 0.0
+
+    def aplicar_comando(self, planta: int, comando: Dict[str, Any]) -> bool:
+        """Aplica a una planta un comando en el formato MQTT de SistemaSimulacion; False si no se reconoce"""
+        if comando.get("tipo") == "valvula":
+            self.cambiar_valvula(planta, int(comando.get("id")), bool(comando.get("estado")))
+        elif comando.get("comando") in ["valvula1", "valvula2", "valvula3", "valvula4", "valvula5", "valvula6"]:
+            self.cambiar_valvula(planta, int(comando["comando"].replace("valvula", "")), bool(comando.get("valor")))
+        elif comando.get("comando") == "simular_fuga":
+            self.simular_fuga(planta, comando.get("intensidad", 5.0))
+        elif comando.get("comando") == "detener_fuga":
+            self.detener_fuga(planta)
+        else:
+            return False
+        return True
+
+    def get_datos_mqtt(self, planta: int) -> Dict[str, Any]:
+        """Genera el mismo payload que SistemaSimulacion.get_datos_mqtt para una planta"""
+        nivel = self.nivel[planta]
+        estado = self.valvula_estado[planta]
+        presion = self.valvula_presion[planta]
+        sensores = self.sensores[planta]
+        flujos = {"flujo_v1": 0.0, "flujo_v2": 0.0, "flujo_total": float(self.flujo_total[planta])}
+        datos = {clave: round(float(nivel[j]), 1) for j, clave in enumerate(TANQUES)}
+        datos.update({
+            "valvula1_presion_interna": round(float(presion[0]), 1),
+            "valvula1_estado": bool(estado[0]),
+            "valvula2_presion_interna": round(float(presion[1]), 1),
+            "valvula2_estado": bool(estado[1]),
+        })
+        for j, clave in enumerate(TANQUES):
+            datos[f"valvula_{clave}_estado"] = bool(estado[j + 2])
+            datos[f"valvula_{clave}_presion"] = round(float(presion[j + 2]), 1)
+        datos.update({clave: round(float(sensores[j]), 1) for j, clave in enumerate(SENSORES)})
+        datos.update({
+            "toma1_estado": False,
+            "toma1_flujo": 0.0,
+            "toma2_estado": False,
+            "toma2_flujo": 0.0,
+            "sistema_activo": bool(estado.any()),
+            "flujos": flujos,
+            "flujo_total": round(sum(flujos.values()), 2),
+            "tomas_detectadas": False,
+        })
+        return datos
+
+
+class _RuidoSecuencial:
+    """Entrega a la ruta escalar los mismos valores U[0, 1) que consume la flota"""
+
+    def __init__(self, valores: np.ndarray):
+        self._valores = iter(valores.tolist())
+
+    def uniform(self, a: float, b: float) -> float:
+        return a + (b - a) * next(self._valores)
+
+
+def verificar_equivalencia(n_plantas: int = 8, ticks: int = 500, semilla: int = 0) -> float:
+    """Compara flota vs SistemaSimulacion con el mismo ruido; devuelve la diferencia máxima"""
+    rng = np.random.default_rng(semilla)
+    sistemas: List[SistemaSimulacion] = [SistemaSimulacion() for _ in range(n_plantas)]
+    flota = FlotaSimulacion.desde_sistemas(sistemas, semilla)
+    diferencia = 0.0
+
+    for tick in range(ticks):
+        # Cambios de válvulas y fugas pseudoaleatorios para recorrer todas las ramas
+        if tick % 25 == 0:
+            for i, sistema in enumerate(sistemas):
+                for valvula_id in VALVULAS:
+                    estado = bool(rng.random() < 0.7)
+                    sistema.valvulas[valvula_id].estado = estado
+                    flota.cambiar_valvula(i, valvula_id, estado)
+                if rng.random() < 0.3:
+                    sistema.simulando_fuga = True
+                    flota.simular_fuga(i)
+                else:
+                    sistema.simulando_fuga = False
+                    flota.detener_fuga(i)
+
+        u = rng.random((n_plantas, SLOTS_RUIDO))
+        flota.actualizar_sistema(u)
+        for i, sistema in enumerate(sistemas):
+            sistema.ruido = _RuidoSecuencial(u[i])
+            sistema.actualizar_sistema()
+
+        for i, sistema in enumerate(sistemas):
+            escalar = np.array(
+                [sistema.tanques[k].nivel_actual for k in TANQUES]
+                + [sistema.valvulas[v].presion for v in VALVULAS]
+                + [sistema.sensores[k]["presion"] for k in SENSORES]
+            )
+            vectorial = np.concatenate([flota.nivel[i], flota.valvula_presion[i], flota.sensores[i]])
+            diferencia = max(diferencia, float(np.max(np.abs(escalar - vectorial))))
+
+    return diferencia
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Motor vectorizado de flota de plantas")
+    parser.add_argument("--plantas", type=int, default=10000)
+    parser.add_argument("--ticks", type=int, default=200)
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--verificar", action="store_true", help="Comparar contra la ruta escalar")
+    parser.add_argument(
+        "--fugas",
+        type=float,
+        default=0.0,
+        metavar="FRACCION",
+        help="Abrir una fuga en esta fracción de plantas al primer tercio de la corrida y evaluar el detector",
+    )
+    args = parser.parse_args()
+    if args.ticks < 1:
+        parser.error("--ticks debe ser al menos 1")
+
+    if args.verificar:
+        diferencia = verificar_equivalencia(semilla=args.semilla)
+        print(f"🔍 Diferencia máxima flota vs escalar: {diferencia:.3e}")
+
+    flota = FlotaSimulacion(args.plantas, args.semilla)
+    flota.cambiar_valvula(slice(None), 1, True)
+    flota.cambiar_valvula(slice(None), 2, True)
+    flota.cambiar_valvula(slice(None, None, 2), 3, True)
+    flota.cambiar_valvula(slice(None), 5, True)
+
+    detector = DetectorFugas(args.plantas) if args.fugas else None
+    if detector is not None:
+        # Fuga escalón en un subconjunto aleatorio (reproducible con --semilla), con los tanques aún drenando
+        con_fuga = np.random.default_rng(args.semilla).random(args.plantas) < args.fugas
+        tick_fuga = args.ticks // 3
+        primera_alarma = np.full(args.plantas, -1)
+        # Se fija al abrir las fugas; vacía si la corrida no llega a ese tick
+        vigiladas = np.zeros(args.plantas, dtype=bool)
+        duracion_detector = 0.0
+
+    inicio = time.perf_counter()
+    for tick in range(args.ticks):
+        if detector is not None and tick == tick_fuga:
+            flota.simulando_fuga[con_fuga] = True
+        flota.actualizar_sistema()
+        if detector is not None:
+            if tick == tick_fuga:
+                # Sin flujo no hay caída que medir: solo cuentan las fugas abiertas con flujo
+                vigiladas = con_fuga & (flota.flujo_total > 0)
+            t0 = time.perf_counter()
+            eventos = detector.actualizar(
+                tick * 2.0, flota.sensores[:, 1], flota.sensores[:, 2], flota.flujo_total > 0
+            )
+            duracion_detector += time.perf_counter() - t0
+            for evento in eventos:
+                if evento["estado"] == "activa" and primera_alarma[evento["tramo"]] < 0:
+                    primera_alarma[evento["tramo"]] = tick
+    duracion = time.perf_counter() - inicio
+
+    print(
+        f"🚀 {args.plantas} plantas x {args.ticks} ticks: "
+        f"{duracion / args.ticks * 1000:.2f} ms/tick, "
+        f"{args.plantas * args.ticks / duracion:,.0f} plantas-tick/s"
+    )
+    if detector is not None:
+        detectadas = vigiladas & (primera_alarma >= tick_fuga)
+        falsas = (primera_alarma >= 0) & ~con_fuga
+        latencia = primera_alarma[detectadas] - tick_fuga
+        print(
+            f"🚨 Detector: {detectadas.sum()}/{vigiladas.sum()} fugas con flujo detectadas, "
+            f"{falsas.sum()} falsas alarmas, "
+            f"latencia media {latencia.mean() if len(latencia) else float('nan'):.1f} ticks, "
+            f"{duracion_detector / args.ticks * 1000:.2f} ms/tick"
+        )
+
+
+if __name__ == "__main__":
+    main()
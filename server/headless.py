@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import json
+import time
+from typing import Dict, Any, List, Optional
+
+from historial import Historial
+from mqtt_simulator import SistemaSimulacion
+from topologia import cargar_topologia
+
+
+# Columnas planas del payload (sin el dict anidado "flujos")
+COLUMNAS = [
+    "t",
+    "tanque_izq_1", "tanque_izq_2", "tanque_der_1", "tanque_der_2",
+    "valvula1_estado", "valvula1_presion_interna",
+    "valvula2_estado", "valvula2_presion_interna",
+    "valvula_tanque_izq_1_estado", "valvula_tanque_izq_2_estado",
+    "valvula_tanque_der_1_estado", "valvula_tanque_der_2_estado",
+    "sensor_pre_v1", "sensor_post_v1", "sensor_pre_v2", "sensor_post_v2",
+    "flujo_total",
+]
+
+
+def cargar_linea_tiempo(ruta: str) -> List[Dict[str, Any]]:
+    """Carga una línea de tiempo de comandos: [{"t": 10, "comando": {...}}, ...]"""
+    with open(ruta, encoding="utf-8") as f:
+        eventos = json.load(f)
+    return sorted(eventos, key=lambda e: e["t"])
+
+
+class EjecucionHeadless:
+    """Avanza un SistemaSimulacion con reloj virtual, sin broker ni esperas"""
+
+    def __init__(
+        self,
+        sistema: SistemaSimulacion,
+        linea_tiempo: Optional[List[Dict[str, Any]]] = None,
+        dt: float = 2.0,
+        adaptativo: bool = False,
+        dt_max: float = 3600.0,
+    ):
+        self.sistema = sistema
+        self.eventos = linea_tiempo or []
+        self.dt = dt
+        # Paso adaptativo: dt es el paso mínimo; en reposo se salta al próximo evento (o dt_max)
+        self.adaptativo = adaptativo
+        self.dt_max = dt_max
+        self.t = 0.0
+        self.ticks = 0
+        self._siguiente_evento = 0
+
+    def aplicar_eventos(self):
+        """Aplica los comandos programados cuyo instante ya llegó"""
+        while (
+            self._siguiente_evento < len(self.eventos)
+            and self.eventos[self._siguiente_evento]["t"] <= self.t
+        ):
+            self.sistema.aplicar_comando(self.eventos[self._siguiente_evento]["comando"])
+            self._siguiente_evento += 1
+
+    def paso(self, t_fin: Optional[float] = None) -> Dict[str, float]:
+        """Avanza un tick del reloj virtual (de dt fijo, o adaptativo sin pasar del próximo evento ni de t_fin)"""
+        self.aplicar_eventos()
+        if not self.adaptativo:
+            flujos = self.sistema.actualizar_sistema(self.dt)
+            self.t += self.dt
+        else:
+            objetivo = self.t + self.dt_max
+            if self._siguiente_evento < len(self.eventos):
+                objetivo = min(objetivo, self.eventos[self._siguiente_evento]["t"])
+            if t_fin is not None:
+                objetivo = min(objetivo, t_fin)
+            flujos = self.sistema.actualizar_sistema(self.dt, objetivo - self.t)
+            # Un paso que llega al horizonte cae exactamente en él (sin error de redondeo)
+            if self.sistema.ultimo_dt >= objetivo - self.t:
+                self.t = objetivo
+            else:
+                self.t += self.sistema.ultimo_dt
+        self.ticks += 1
+        return flujos
+
+    def ejecutar(self, ticks: Optional[int] = None, salida=None, cada: int = 1, duracion: Optional[float] = None):
+        """Ejecuta ticks pasos o hasta `duracion` segundos simulados; escribe una fila cada `cada` ticks"""
+        inicial = self.ticks
+        while (ticks is None or self.ticks - inicial < ticks) and (duracion is None or self.t < duracion):
+            flujos = self.paso(duracion)
+            if salida is not None and self.ticks % cada == 0:
+                salida.escribir(self.t, self.sistema.get_datos_mqtt(flujos))
+
+
+class SalidaCSV:
+    def __init__(self, archivo):
+        self._writer = csv.writer(archivo)
+        self._columnas: Optional[List[str]] = None
+
+    def escribir(self, t: float, datos: Dict[str, Any]):
+        if self._columnas is None:
+            # Planta de 4 tanques: columnas fijas; otras topologías: todos los campos planos
+            if "tanque_izq_1" in datos:
+                self._columnas = COLUMNAS[1:]
+            else:
+                self._columnas = [k for k in datos if k != "flujos"]
+            self._writer.writerow(["t"] + self._columnas)
+        self._writer.writerow([t] + [datos[c] for c in self._columnas])
+
+
+class SalidaJSONL:
+    def __init__(self, archivo):
+        self._archivo = archivo
+
+    def escribir(self, t: float, datos: Dict[str, Any]):
+        datos["t"] = t
+        self._archivo.write(json.dumps(datos) + "\n")
+
+
+class SalidaHistorial:
+    """Graba los frames en el historial en disco con el tiempo virtual"""
+
+    def __init__(self, historial: Historial, planta: str):
+        self._historial = historial
+        self._planta = planta
+
+    def escribir(self, t: float, datos: Dict[str, Any]):
+        self._historial.registrar(self._planta, t, datos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulación headless con reloj virtual (sin MQTT)")
+    parser.add_argument("--ticks", type=int, default=100000)
+    parser.add_argument("--duracion", type=float, help="Segundos simulados a ejecutar (en lugar de --ticks)")
+    parser.add_argument("--dt", type=float, default=2.0, help="Segundos simulados por tick (mínimo si es adaptativo)")
+    parser.add_argument(
+        "--adaptativo", action="store_true", help="Pasos largos en reposo y cortos cerca de llenado/vaciado"
+    )
+    parser.add_argument("--dt-max", type=float, default=3600.0, help="Paso máximo con --adaptativo")
+    parser.add_argument("--linea-tiempo", help="JSON con comandos programados por instante")
+    destino = parser.add_mutually_exclusive_group()
+    destino.add_argument("--salida", help="Archivo de resultados (.csv o .jsonl)")
+    destino.add_argument("--historial", metavar="DIR", help="Grabar en el historial en disco de DIR")
+    parser.add_argument("--cada", type=int, default=1, help="Escribir una fila cada N ticks")
+    parser.add_argument("--semilla", type=int)
+    parser.add_argument("--topologia", help="JSON de topología (por defecto la planta de 4 tanques)")
+    parser.add_argument("--restaurar", metavar="ARCHIVO", help="Partir del estado de una instantánea")
+    parser.add_argument(
+        "--instantanea", metavar="ARCHIVO", help="Guardar el estado final (para arrancar el simulador en vivo desde ahí)"
+    )
+    args = parser.parse_args()
+
+    linea_tiempo = cargar_linea_tiempo(args.linea_tiempo) if args.linea_tiempo else None
+    topologia = cargar_topologia(args.topologia)
+    sistema = SistemaSimulacion(topologia, args.semilla)
+    if args.restaurar:
+        sistema.restaurar_instantanea(args.restaurar)
+    ejecucion = EjecucionHeadless(sistema, linea_tiempo, args.dt, args.adaptativo, args.dt_max)
+    ticks = None if args.duracion is not None else args.ticks
+
+    inicio = time.perf_counter()
+    if args.salida:
+        with open(args.salida, "w", newline="", encoding="utf-8") as f:
+            salida = SalidaJSONL(f) if args.salida.endswith(".jsonl") else SalidaCSV(f)
+            ejecucion.ejecutar(ticks, salida, args.cada, args.duracion)
+    elif args.historial:
+        historial = Historial(args.historial)
+        ejecucion.ejecutar(ticks, SalidaHistorial(historial, topologia.nombre), args.cada, args.duracion)
+        historial.cerrar()
+    else:
+        ejecucion.ejecutar(ticks, duracion=args.duracion)
+    duracion = time.perf_counter() - inicio
+
+    print(
+        f"⏱️  {ejecucion.ticks} ticks ({ejecucion.t:.0f}s simulados) en {duracion:.2f}s "
+        f"→ {ejecucion.ticks / duracion * 60:,.0f} ticks/min"
+    )
+    if args.instantanea:
+        sistema.guardar_instantanea(args.instantanea)
+        print(f"📸 Estado final en {args.instantanea}")
+
+
+if __name__ == "__main__":
+    main()
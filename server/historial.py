@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import logging
+import math
+import operator
+import os
+import time
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+log = logging.getLogger("simulador.historial")
+
+
+# Niveles de resolución: (nombre, ancho del bucket en segundos, capacidad del anillo).
+# "crudo" guarda cada frame; los demás min/max/avg/n por bucket, en cascada 1s -> 1min -> 1h
+NIVELES: Tuple[Tuple[str, float, int], ...] = (
+    ("crudo", 0.0, 1 << 18),  # ~6 días a un frame cada 2 s
+    ("1s", 1.0, 1 << 16),  # ~18 h con un bucket por segundo
+    ("1min", 60.0, 1 << 17),  # ~91 días
+    ("1h", 3600.0, 1 << 15),  # ~3,7 años
+)
+# Estadísticos por bucket en los niveles agregados
+ESTADISTICOS = ("min", "max", "avg", "n")
+
+
+def columnas_numericas(datos: Dict[str, Any]) -> List[str]:
+    """Campos escalares numéricos o booleanos del payload, en su orden (deja fuera el dict "flujos")"""
+    return [c for c, v in datos.items() if isinstance(v, (int, float))]
+
+
+def columnas_booleanas(datos: Dict[str, Any]) -> List[str]:
+    """Campos booleanos del payload (se guardan como 0/1 y se restauran al reproducir)"""
+    return [c for c, v in datos.items() if isinstance(v, bool)]
+
+
+class _Acumulador:
+    """Bucket en curso de un nivel agregado"""
+
+    __slots__ = ("bucket", "fila", "minimo", "maximo", "suma", "n")
+
+    def __init__(self, n_columnas: int):
+        self.bucket: Optional[int] = None
+        # Fila min/max/avg/n que se escribe al cerrar el bucket; suma aparte
+        self.fila = np.empty((len(ESTADISTICOS), n_columnas))
+        self.minimo, self.maximo = self.fila[0], self.fila[1]
+        self.minimo.fill(np.inf)
+        self.maximo.fill(-np.inf)
+        self.suma = np.zeros(n_columnas)
+        self.n = 0
+
+    def reiniciar(self, bucket: int):
+        self.bucket = bucket
+        self.minimo.fill(np.inf)
+        self.maximo.fill(-np.inf)
+        self.suma.fill(0.0)
+        self.n = 0
+
+
+class _Anillo:
+    """Anillo en disco de un nivel: tiempos (float64) y valores columnares (float32) en memmap"""
+
+    def __init__(self, directorio: str, nombre: str, n_estadisticos: int, n_columnas: int, capacidad: int, modo: str):
+        base = os.path.join(directorio, nombre)
+        self.capacidad = capacidad
+        self._mapas = [
+            np.memmap(base + ".t", np.float64, modo, shape=(capacidad,)),
+            # (estadístico, columna, posición): cada columna es contigua en disco
+            np.memmap(base + ".val", np.float32, modo, shape=(n_estadisticos, n_columnas, capacidad)),
+            # [próxima posición de escritura, filas escritas en total]
+            np.memmap(base + ".pos", np.int64, modo, shape=(2,)),
+        ]
+        # Vistas ndarray sobre los mismos mapas: evitan el costo de la subclase memmap por acceso
+        self.t, self.valores, self.cabeza = (m.view(np.ndarray) for m in self._mapas)
+
+    @property
+    def filas(self) -> int:
+        return int(min(self.cabeza[1], self.capacidad))
+
+    def escribir(self, t: float, valores: np.ndarray):
+        i = int(self.cabeza[0])
+        self.t[i] = t
+        self.valores[:, :, i] = valores
+        self.cabeza[0] = (i + 1) % self.capacidad
+        self.cabeza[1] += 1
+
+    def reescribir_ultima(self, valores: np.ndarray):
+        self.valores[:, :, (int(self.cabeza[0]) - 1) % self.capacidad] = valores
+
+    def ultima(self) -> np.ndarray:
+        return self.valores[:, :, (int(self.cabeza[0]) - 1) % self.capacidad]
+
+    def ultimo_t(self) -> float:
+        if not self.cabeza[1]:
+            return -math.inf
+        return float(self.t[(int(self.cabeza[0]) - 1) % self.capacidad])
+
+    @property
+    def completo(self) -> bool:
+        """True si el anillo aún conserva todo lo escrito (no dio la vuelta)"""
+        return self.cabeza[1] <= self.capacidad
+
+    def primer_t(self) -> float:
+        if not self.cabeza[1]:
+            return math.inf
+        return float(self.t[0 if self.completo else int(self.cabeza[0])])
+
+    def tramos(self, desde: float, hasta: float) -> List[slice]:
+        """Posiciones físicas con desde <= t <= hasta, en orden cronológico (hasta 2 tramos)"""
+        cabeza, filas = int(self.cabeza[0]), self.filas
+        # El anillo lleno son dos tramos ordenados: [cabeza, capacidad) y [0, cabeza)
+        segmentos = [(cabeza, self.capacidad), (0, cabeza)] if filas == self.capacidad else [(0, filas)]
+        tramos = []
+        for inicio, fin in segmentos:
+            t = self.t[inicio:fin]
+            a = inicio + int(np.searchsorted(t, desde, "left"))
+            b = inicio + int(np.searchsorted(t, hasta, "right"))
+            if b > a:
+                tramos.append(slice(a, b))
+        return tramos
+
+    def flush(self):
+        for mapa in self._mapas:
+            mapa.flush()
+
+
+class HistorialPlanta:
+    """Serie temporal de una planta: frames crudos y rollups 1s/1min/1h en anillos memmap"""
+
+    def __init__(
+        self,
+        directorio: str,
+        columnas: Optional[List[str]] = None,
+        niveles=NIVELES,
+        booleanas: Optional[List[str]] = None,
+        solo_lectura: bool = False,
+    ):
+        self.directorio = directorio
+        ruta_meta = os.path.join(directorio, "meta.json")
+        if os.path.exists(ruta_meta):
+            with open(ruta_meta, encoding="utf-8") as f:
+                meta = json.load(f)
+            # Solo lectura: otro proceso (el simulador) sigue escribiendo sobre los mismos mapas
+            modo = "r" if solo_lectura else "r+"
+        else:
+            if columnas is None or solo_lectura:
+                raise ValueError(f"Historial inexistente en {directorio} y sin columnas para crearlo")
+            os.makedirs(directorio, exist_ok=True)
+            meta = {
+                "columnas": list(columnas),
+                "booleanas": list(booleanas or []),
+                "niveles": [list(n) for n in niveles],
+            }
+            modo = "w+"
+
+        self.columnas: List[str] = meta["columnas"]
+        self.booleanas = set(meta.get("booleanas", []))
+        self.niveles: List[Tuple[str, float, int]] = [tuple(n) for n in meta["niveles"]]
+        self._indice = {c: i for i, c in enumerate(self.columnas)}
+        self._extraer = operator.itemgetter(*self.columnas)
+        n = len(self.columnas)
+        self.anillos: Dict[str, _Anillo] = {
+            nombre: _Anillo(directorio, nombre, 1 if ancho == 0 else len(ESTADISTICOS), n, capacidad, modo)
+            for nombre, ancho, capacidad in self.niveles
+        }
+        # El meta se escribe al final: un directorio con meta.json siempre tiene sus anillos
+        if modo == "w+":
+            with open(ruta_meta, "w", encoding="utf-8") as f:
+                json.dump(meta, f, indent=2)
+
+        self._acumuladores = {nombre: _Acumulador(n) for nombre, ancho, _ in self.niveles if ancho > 0}
+        self._agregados = [(nombre, ancho) for nombre, ancho, _ in self.niveles if ancho > 0]
+        self._ultimo_t = self.anillos[self.niveles[0][0]].ultimo_t()
+        self.descartados = 0
+
+    def registrar(self, t: float, datos: Dict[str, Any]):
+        """Agrega un frame (payload de get_datos_mqtt) en el instante t y actualiza los rollups"""
+        if t < self._ultimo_t:
+            # Las búsquedas asumen tiempo creciente (reloj hacia atrás o reinicio de un headless)
+            self.descartados += 1
+            if self.descartados == 1:
+                log.warning("⚠️  Frame anterior al último registrado en %s: se descarta", self.directorio)
+            return
+        self._ultimo_t = t
+        try:
+            valores = np.array(self._extraer(datos), np.float64).reshape(-1)
+        except KeyError:
+            valores = np.array([datos.get(c, np.nan) for c in self.columnas], np.float64)
+        self.anillos[self.niveles[0][0]].escribir(t, valores)
+        self._acumular(0, t, valores, valores, valores, 1)
+
+    def _acumular(self, nivel: int, t: float, minimo, maximo, suma, n: int):
+        if nivel == len(self._agregados):
+            return
+        nombre, ancho = self._agregados[nivel]
+        acumulador = self._acumuladores[nombre]
+        bucket = int(t // ancho)
+        if acumulador.bucket != bucket:
+            if acumulador.n:
+                self._cerrar_bucket(nivel)
+            acumulador.reiniciar(bucket)
+        np.minimum(acumulador.minimo, minimo, out=acumulador.minimo)
+        np.maximum(acumulador.maximo, maximo, out=acumulador.maximo)
+        acumulador.suma += suma
+        acumulador.n += n
+
+    def _cerrar_bucket(self, nivel: int):
+        """Escribe el bucket en curso y lo propaga al nivel siguiente"""
+        nombre, ancho = self._agregados[nivel]
+        a = self._acumuladores[nombre]
+        t = a.bucket * ancho
+        np.divide(a.suma, a.n, out=a.fila[2])
+        a.fila[3] = a.n
+        anillo = self.anillos[nombre]
+        if anillo.ultimo_t() == t:
+            # El bucket ya tiene fila (cerrar() lo escribió parcial antes de reabrir): se fusiona en ella
+            previa = anillo.ultima().astype(np.float64)
+            n = previa[3] + a.n
+            anillo.reescribir_ultima([
+                np.minimum(previa[0], a.minimo),
+                np.maximum(previa[1], a.maximo),
+                (previa[2] * previa[3] + a.suma) / n,
+                n,
+            ])
+        else:
+            anillo.escribir(t, a.fila)
+        # Al nivel siguiente solo va lo nuevo: lo ya escrito se propagó en su momento
+        self._acumular(nivel + 1, t, a.minimo, a.maximo, a.suma, a.n)
+
+    def consultar(
+        self,
+        desde: float,
+        hasta: float,
+        columnas: Optional[List[str]] = None,
+        resolucion: Optional[str] = None,
+        max_puntos: int = 1000,
+    ) -> Dict[str, Any]:
+        """Datos entre desde y hasta (inclusive). Sin resolución elige el nivel más fino que cubre
+        el rango con a lo sumo max_puntos; crudo devuelve valores y los agregados min/max/avg/n
+        de los buckets ya cerrados"""
+        columnas = columnas or self.columnas
+        desconocidas = [c for c in columnas if c not in self._indice]
+        if desconocidas:
+            raise KeyError(f"Columnas desconocidas: {desconocidas}")
+        if resolucion is None:
+            resolucion = self.elegir_resolucion(desde, hasta, max_puntos)
+        elif resolucion not in self.anillos:
+            raise KeyError(f"Resolución desconocida: {resolucion} (disponibles: {list(self.anillos)})")
+
+        anillo = self.anillos[resolucion]
+        tramos = anillo.tramos(desde, hasta)
+        indices = [self._indice[c] for c in columnas]
+        t = np.concatenate([anillo.t[s] for s in tramos]) if tramos else np.empty(0)
+        valores = (
+            np.concatenate([anillo.valores[:, indices, s] for s in tramos], axis=2)
+            if tramos
+            else np.empty((anillo.valores.shape[0], len(indices), 0), np.float32)
+        )
+        if resolucion == self.niveles[0][0]:
+            series = {c: valores[0, j] for j, c in enumerate(columnas)}
+        else:
+            series = {
+                c: {e: valores[k, j] for k, e in enumerate(ESTADISTICOS)} for j, c in enumerate(columnas)
+            }
+        return {"resolucion": resolucion, "t": t, "series": series}
+
+    def bloques_crudos(
+        self, desde: float, hasta: float, columnas: Optional[List[str]] = None, filas: int = 1000
+    ) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Frames crudos entre desde y hasta en bloques de hasta `filas`: (t, valores[columna, fila])"""
+        indices = [self._indice[c] for c in columnas or self.columnas]
+        anillo = self.anillos[self.niveles[0][0]]
+        for tramo in anillo.tramos(desde, hasta):
+            for inicio in range(tramo.start, tramo.stop, filas):
+                fin = min(inicio + filas, tramo.stop)
+                yield anillo.t[inicio:fin].copy(), anillo.valores[0, indices, inicio:fin]
+
+    def elegir_resolucion(self, desde: float, hasta: float, max_puntos: int) -> str:
+        for nombre, _, _ in self.niveles:
+            anillo = self.anillos[nombre]
+            # El nivel debe retener el inicio del rango (o no haber descartado nada todavía)
+            cubre = anillo.completo or anillo.primer_t() <= desde
+            filas = sum(s.stop - s.start for s in anillo.tramos(desde, hasta))
+            if cubre and filas <= max_puntos:
+                return nombre
+        return self.niveles[-1][0]
+
+    def cerrar(self):
+        """Escribe los buckets parciales y sincroniza los anillos a disco"""
+        for nivel in range(len(self._agregados)):
+            acumulador = self._acumuladores[self._agregados[nivel][0]]
+            if acumulador.n:
+                self._cerrar_bucket(nivel)
+                acumulador.reiniciar(acumulador.bucket)
+        for anillo in self.anillos.values():
+            anillo.flush()
+
+
+class Historial:
+    """Historiales por planta bajo un directorio (uno por subdirectorio)"""
+
+    def __init__(self, directorio: str, niveles=NIVELES, solo_lectura: bool = False):
+        self.directorio = directorio
+        self.niveles = niveles
+        self.solo_lectura = solo_lectura
+        self.plantas: Dict[str, HistorialPlanta] = {}
+        if not solo_lectura:
+            os.makedirs(directorio, exist_ok=True)
+
+    def planta(
+        self, planta_id: str, columnas: Optional[List[str]] = None, booleanas: Optional[List[str]] = None
+    ) -> HistorialPlanta:
+        historial = self.plantas.get(planta_id)
+        if historial is None:
+            if not planta_id or os.sep in planta_id or planta_id.startswith("."):
+                raise ValueError(f"Id de planta inválido: {planta_id!r}")
+            historial = HistorialPlanta(
+                os.path.join(self.directorio, planta_id), columnas, self.niveles, booleanas, self.solo_lectura
+            )
+            self.plantas[planta_id] = historial
+        return historial
+
+    def registrar(self, planta_id: str, t: float, datos: Dict[str, Any]):
+        historial = self.plantas.get(planta_id)
+        if historial is None:
+            historial = self.planta(planta_id, columnas_numericas(datos), columnas_booleanas(datos))
+        historial.registrar(t, datos)
+
+    def disponibles(self) -> List[str]:
+        if not os.path.isdir(self.directorio):
+            return []
+        return sorted(
+            d for d in os.listdir(self.directorio) if os.path.exists(os.path.join(self.directorio, d, "meta.json"))
+        )
+
+    def cerrar(self):
+        if self.solo_lectura:
+            return
+        for historial in self.plantas.values():
+            historial.cerrar()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Consulta del historial de telemetría")
+    parser.add_argument("directorio")
+    parser.add_argument("--planta", default="planta")
+    parser.add_argument("--columnas", help="Lista separada por comas (por defecto todas)")
+    parser.add_argument("--ultimos", type=float, default=3600.0, help="Segundos hasta el último dato")
+    parser.add_argument("--resolucion", help="crudo, 1s, 1min o 1h (por defecto automática)")
+    parser.add_argument("--max-puntos", type=int, default=20)
+    args = parser.parse_args()
+
+    historial = Historial(args.directorio, solo_lectura=True)
+    if args.planta not in historial.disponibles():
+        print(f"⚠️  Sin historial para {args.planta!r} (disponibles: {historial.disponibles()})")
+        return
+    planta = historial.planta(args.planta)
+    hasta = planta.anillos[planta.niveles[0][0]].ultimo_t()
+    columnas = args.columnas.split(",") if args.columnas else None
+
+    inicio = time.perf_counter()
+    resultado = planta.consultar(hasta - args.ultimos, hasta, columnas, args.resolucion, args.max_puntos)
+    duracion = time.perf_counter() - inicio
+
+    print(f"🗄️  {args.planta}: {len(resultado['t'])} puntos ({resultado['resolucion']}) en {duracion * 1000:.1f} ms")
+    for nombre, anillo in planta.anillos.items():
+        print(f"   {nombre:6} {anillo.filas:>8} filas")
+    for columna, serie in resultado["series"].items():
+        valores = serie if isinstance(serie, np.ndarray) else serie["avg"]
+        if len(valores):
+            print(f"   {columna:32} min={np.min(valores):.1f} max={np.max(valores):.1f} último={valores[-1]:.1f}")
+
+
+if __name__ == "__main__":
+    main()
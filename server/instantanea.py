@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import time
+from typing import Dict, Any, List
+
+import numpy as np
+
+# Versión del formato; cargar() rechaza otras
+FORMATO = 1
+
+_MASCARA_64 = (1 << 64) - 1
+
+
+def _partir_128(valor: int) -> List[int]:
+    return [valor >> 64, valor & _MASCARA_64]
+
+
+def _unir_128(alto: int, bajo: int) -> int:
+    return (alto << 64) | bajo
+
+
+def capturar(sistemas: Dict[str, Any]) -> Dict[str, np.ndarray]:
+    """Estado completo de varias SistemaSimulacion de la misma topología, en columnas (planta x campo)"""
+    ids = list(sistemas)
+    primero = sistemas[ids[0]]
+    tanques = list(primero.tanques)
+    valvulas = list(primero.valvulas)
+    sensores = list(primero.sensores)
+    estados_ruido = []
+    for planta_id in ids:
+        ruido = sistemas[planta_id].ruido
+        if not hasattr(ruido, "estado"):
+            raise TypeError(f"La fuente de ruido de {planta_id} no es serializable: {type(ruido).__name__}")
+        estado = ruido.estado()
+        if estado["generador"]["bit_generator"] != "PCG64":
+            raise TypeError(f"Generador no soportado: {estado['generador']['bit_generator']}")
+        estados_ruido.append(estado)
+
+    s = [sistemas[planta_id] for planta_id in ids]
+    arreglos = {
+        "capacidad": np.array([[x.tanques[t].capacidad for t in tanques] for x in s]),
+        "nivel": np.array([[x.tanques[t].nivel_actual for t in tanques] for x in s]),
+        "flujo_entrada": np.array([[x.tanques[t].flujo_entrada for t in tanques] for x in s]),
+        "flujo_salida": np.array([[x.tanques[t].flujo_salida for t in tanques] for x in s]),
+        "valvula_estado": np.array([[bool(x.valvulas[v].estado) for v in valvulas] for x in s]),
+        "valvula_presion": np.array([[x.valvulas[v].presion for v in valvulas] for x in s]),
+        "sensores": np.array([[x.sensores[k]["presion"] for k in sensores] for x in s]),
+        "simulando_fuga": np.array([x.simulando_fuga for x in s]),
+        "fuga_intensidad": np.array([x.fuga_intensidad for x in s]),
+        "flujo_base": np.array([x.flujo_base for x in s]),
+        "pausado": np.array([x.pausado for x in s]),
+        "periodo": np.array([x.periodo for x in s]),
+        "ultimo_dt": np.array([x.ultimo_dt for x in s]),
+        # PCG64: estado e incremento de 128 bits en dos mitades de 64
+        "ruido_generador": np.array(
+            [
+                _partir_128(e["generador"]["state"]["state"]) + _partir_128(e["generador"]["state"]["inc"])
+                for e in estados_ruido
+            ],
+            dtype=np.uint64,
+        ),
+        "ruido_uint32": np.array(
+            [[e["generador"]["has_uint32"], e["generador"]["uinteger"]] for e in estados_ruido], dtype=np.uint64
+        ),
+        "ruido_posicion": np.array([e["posicion"] for e in estados_ruido], dtype=np.int64),
+        "ruido_bloque": np.array([e["bloque"] for e in estados_ruido], dtype=np.int64),
+    }
+    # Presiones del tick anterior en topologías de red: arranque en caliente del gradiente conjugado
+    if primero.red is not None:
+        arreglos["red_presiones"] = np.array([x.red.presiones for x in s])
+
+    meta = {
+        "formato": FORMATO,
+        "creada": time.time(),
+        "topologia": primero.topologia.nombre,
+        "ids": ids,
+        "tanques": tanques,
+        "valvulas": valvulas,
+        "sensores": sensores,
+    }
+    arreglos["meta"] = np.array(json.dumps(meta))
+    return arreglos
+
+
+def aplicar(sistemas: Dict[str, Any], arreglos: Dict[str, np.ndarray]) -> int:
+    """Carga una captura en las plantas con el mismo id; devuelve cuántas se restauraron"""
+    meta = json.loads(str(arreglos["meta"]))
+    if meta.get("formato") != FORMATO:
+        raise ValueError(f"Formato de instantánea no soportado: {meta.get('formato')}")
+    fila = {planta_id: i for i, planta_id in enumerate(meta["ids"])}
+    # Listas de Python: indexar escalares de NumPy campo por campo cuesta varias veces más
+    c = {nombre: a.tolist() for nombre, a in arreglos.items() if nombre not in ("meta", "red_presiones")}
+    restauradas = 0
+    for planta_id, sistema in sistemas.items():
+        i = fila.get(planta_id)
+        if i is None:
+            continue
+        if (list(sistema.tanques), list(sistema.valvulas), list(sistema.sensores)) != (
+            meta["tanques"],
+            meta["valvulas"],
+            meta["sensores"],
+        ):
+            raise ValueError(f"La instantánea es de otra topología ({meta['topologia']})")
+
+        for j, t in enumerate(meta["tanques"]):
+            tanque = sistema.tanques[t]
+            tanque.capacidad = c["capacidad"][i][j]
+            tanque.nivel_actual = c["nivel"][i][j]
+            tanque.flujo_entrada = c["flujo_entrada"][i][j]
+            tanque.flujo_salida = c["flujo_salida"][i][j]
+        for j, v in enumerate(meta["valvulas"]):
+            sistema.valvulas[v].estado = c["valvula_estado"][i][j]
+            sistema.valvulas[v].presion = c["valvula_presion"][i][j]
+        for j, k in enumerate(meta["sensores"]):
+            sistema.sensores[k]["presion"] = c["sensores"][i][j]
+        sistema.simulando_fuga = c["simulando_fuga"][i]
+        sistema.fuga_intensidad = c["fuga_intensidad"][i]
+        sistema.flujo_base = c["flujo_base"][i]
+        sistema.pausado = c["pausado"][i]
+        sistema.pasos_pendientes = 0
+        sistema.periodo = c["periodo"][i]
+        sistema.ultimo_dt = c["ultimo_dt"][i]
+        if sistema.red is not None and "red_presiones" in arreglos:
+            sistema.red.presiones[:] = arreglos["red_presiones"][i]
+
+        g = c["ruido_generador"][i]
+        has_uint32, uinteger = c["ruido_uint32"][i]
+        sistema.ruido.restaurar({
+            "generador": {
+                "bit_generator": "PCG64",
+                "state": {"state": _unir_128(g[0], g[1]), "inc": _unir_128(g[2], g[3])},
+                "has_uint32": has_uint32,
+                "uinteger": uinteger,
+            },
+            "bloque": c["ruido_bloque"][i],
+            "posicion": c["ruido_posicion"][i],
+        })
+        restauradas += 1
+    return restauradas
+
+
+def guardar(ruta: str, sistemas: Dict[str, Any]) -> int:
+    """Escribe la instantánea de forma atómica; devuelve los bytes escritos"""
+    arreglos = capturar(sistemas)
+    # Temporal en el mismo directorio + fsync + rename: ante un corte queda la anterior o la nueva, nunca media
+    temporal = f"{ruta}.tmp"
+    with open(temporal, "wb") as f:
+        np.savez(f, **arreglos)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporal, ruta)
+    return os.path.getsize(ruta)
+
+
+def cargar(ruta: str) -> Dict[str, np.ndarray]:
+    with np.load(ruta) as datos:
+        return {nombre: datos[nombre] for nombre in datos.files}
+
+
+def restaurar(ruta: str, sistemas: Dict[str, Any]) -> int:
+    """Carga la instantánea de `ruta` en las plantas; devuelve cuántas se restauraron"""
+    return aplicar(sistemas, cargar(ruta))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resumen de una instantánea del simulador")
+    parser.add_argument("archivo")
+    args = parser.parse_args()
+
+    arreglos = cargar(args.archivo)
+    meta = json.loads(str(arreglos["meta"]))
+    print(
+        f"📸 {args.archivo}: {len(meta['ids'])} planta(s) de {meta['topologia']}, "
+        f"creada {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(meta['creada']))}, "
+        f"{os.path.getsize(args.archivo):,} bytes"
+    )
+    for i, planta_id in enumerate(meta["ids"][:10]):
+        niveles = ", ".join(f"{t}={n:.1f}" for t, n in zip(meta["tanques"], arreglos["nivel"][i]))
+        fuga = " 💧 fuga" if arreglos["simulando_fuga"][i] else ""
+        print(f"  {planta_id}: {niveles}{fuga}")
+    if len(meta["ids"]) > 10:
+        print(f"  ... y {len(meta['ids']) - 10} más")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Any, List, Tuple
+
+
+# Sub-buckets por potencia de 2: error relativo máximo ~3% (estilo HDR)
+SUB_BITS = 5
+SUB_BUCKETS = 1 << SUB_BITS
+
+
+class Histograma:
+    """Histograma log-lineal de latencias en nanosegundos con registro O(1)"""
+
+    def __init__(self):
+        self.conteos: List[int] = [0] * (64 * SUB_BUCKETS)
+        self.total = 0
+        self.suma = 0
+        self.maximo = 0
+
+    @staticmethod
+    def _indice(valor: int) -> int:
+        desplazamiento = max(0, valor.bit_length() - SUB_BITS - 1)
+        return (desplazamiento << SUB_BITS) + (valor >> desplazamiento)
+
+    @staticmethod
+    def _limite_inferior(indice: int) -> int:
+        desplazamiento = max(0, (indice >> SUB_BITS) - 1)
+        return (indice - (desplazamiento << SUB_BITS)) << desplazamiento
+
+    def registrar(self, ns: int):
+        self.conteos[self._indice(ns)] += 1
+        self.total += 1
+        self.suma += ns
+        if ns > self.maximo:
+            self.maximo = ns
+
+    def percentil(self, p: float) -> int:
+        """Valor (ns) bajo el cual cae el p% de las muestras"""
+        if not self.total:
+            return 0
+        objetivo = max(1, round(self.total * p / 100.0))
+        acumulado = 0
+        for indice, conteo in enumerate(self.conteos):
+            acumulado += conteo
+            if acumulado >= objetivo:
+                return min(self._limite_inferior(indice + 1) - 1, self.maximo)
+        return self.maximo
+
+
+class Metricas:
+    """Temporizadores por fase, contadores y medidores del bucle de simulación"""
+
+    CUANTILES = (50, 90, 99, 99.9)
+
+    def __init__(self):
+        self.fases: Dict[str, Histograma] = {}
+        self.contadores: Dict[str, int] = {}
+        # Valores leídos al exportar (profundidad de colas, contadores de otros componentes)
+        self.observados: Dict[str, Tuple[str, Callable[[], float]]] = {}
+
+    def registrar(self, fase: str, ns: int):
+        histograma = self.fases.get(fase)
+        if histograma is None:
+            histograma = self.fases[fase] = Histograma()
+        histograma.registrar(ns)
+
+    @contextmanager
+    def medir(self, fase: str):
+        inicio = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.registrar(fase, time.perf_counter_ns() - inicio)
+
+    def incrementar(self, nombre: str, n: int = 1):
+        self.contadores[nombre] = self.contadores.get(nombre, 0) + n
+
+    def observar(self, nombre: str, funcion: Callable[[], float], tipo: str = "gauge"):
+        self.observados[nombre] = (tipo, funcion)
+
+    def resumen(self) -> Dict[str, Any]:
+        """Resumen compacto (µs) para publicar por MQTT"""
+        return {
+            "fases_us": {
+                fase: {
+                    "n": h.total,
+                    "p50": h.percentil(50) / 1000,
+                    "p99": h.percentil(99) / 1000,
+                    "max": h.maximo / 1000,
+                }
+                for fase, h in self.fases.items()
+            },
+            **self.contadores,
+            **{nombre: funcion() for nombre, (_, funcion) in self.observados.items()},
+        }
+
+    def texto_prometheus(self) -> str:
+        """Exposición en formato de texto de Prometheus"""
+        lineas = ["# TYPE simulador_fase_segundos summary"]
+        for fase, h in list(self.fases.items()):
+            for q in self.CUANTILES:
+                lineas.append(
+                    f'simulador_fase_segundos{{fase="{fase}",quantile="{q / 100:g}"}} {h.percentil(q) / 1e9:.9f}'
+                )
+            lineas.append(f'simulador_fase_segundos_sum{{fase="{fase}"}} {h.suma / 1e9:.9f}')
+            lineas.append(f'simulador_fase_segundos_count{{fase="{fase}"}} {h.total}')
+        for nombre, valor in list(self.contadores.items()):
+            lineas.append(f"# TYPE simulador_{nombre} counter")
+            lineas.append(f"simulador_{nombre} {valor}")
+        for nombre, (tipo, funcion) in list(self.observados.items()):
+            lineas.append(f"# TYPE simulador_{nombre} {tipo}")
+            lineas.append(f"simulador_{nombre} {funcion()}")
+        return "\n".join(lineas) + "\n"
+
+
+def servir_prometheus(metricas: Metricas, puerto: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Sirve /metrics en un hilo daemon"""
+
+    class Manejador(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            cuerpo = metricas.texto_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def log_message(self, *args):
+            pass
+
+    servidor = ThreadingHTTPServer((host, puerto), Manejador)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import paho.mqtt.client as mqtt
+from paho.mqtt.client import CallbackAPIVersion
+
+from mqtt_simulator import SistemaSimulacion
+from detector_fugas import DetectorFugas, muestra, tramo_vigilado
+from historial import Historial
+import instantanea
+from registro import configurar_registro
+from ruido import semillas_por_planta
+
+log = logging.getLogger("simulador.asincrono")
+
+
+class _PuenteAsyncio:
+    """Conecta el socket de un cliente paho al event loop (sin hilo de red)"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, client: mqtt.Client):
+        self.loop = loop
+        self.client = client
+        self._misc = None
+        client.on_socket_open = self.on_socket_open
+        client.on_socket_close = self.on_socket_close
+        client.on_socket_register_write = self.on_socket_register_write
+        client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def on_socket_open(self, client, userdata, sock):
+        # También en cada reconexión: el socket nuevo vuelve a quedar integrado al loop
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 2048 * 1024)
+        self.loop.add_reader(sock, client.loop_read)
+        self._misc = self.loop.create_task(self._loop_misc())
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.loop.add_writer(sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.loop.remove_writer(sock)
+
+    def on_socket_close(self, client, userdata, sock):
+        self.loop.remove_reader(sock)
+        if self._misc:
+            self._misc.cancel()
+
+    async def _loop_misc(self):
+        # Keepalive y reintentos de paho, una vez por segundo
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+
+class GestorMQTTAsincrono:
+    """Multiplexa muchas plantas sobre un pool pequeño de conexiones en un solo event loop"""
+
+    def __init__(
+        self,
+        plantas: Dict[str, SistemaSimulacion],
+        host: str = "localhost",
+        puerto: int = 1883,
+        conexiones: int = 1,
+        capacidad_cola: int = 10000,
+        tamano_lote: int = 500,
+        max_sin_escribir: int = 2000,
+        historial: Optional[Historial] = None,
+        instantanea: Optional[str] = None,
+        instantanea_cada: int = 0,
+    ):
+        self.plantas = plantas
+        self.host = host
+        self.puerto = puerto
+        self.n_conexiones = conexiones
+        self.capacidad_cola = capacidad_cola
+        self.tamano_lote = tamano_lote
+        self.clientes: List[mqtt.Client] = []
+        # Asignación fija planta -> conexión (round-robin)
+        self._conexion_de = {planta_id: i % conexiones for i, planta_id in enumerate(plantas)}
+        self.cola: asyncio.Queue = None
+        self.publicados = 0
+        # publish() con QoS 0 solo encola en paho (sin límite): se cuentan los paquetes que el socket
+        # todavía no aceptó y no se saca nada de la cola mientras superen max_sin_escribir
+        self.max_sin_escribir = max_sin_escribir
+        self._sin_escribir = [0] * conexiones
+        self._escritos: asyncio.Event = None
+        # Mensajes perdidos por falta de conexión y reconexiones en curso (una tarea por conexión)
+        self.descartados = 0
+        self._reconectando: Dict[int, asyncio.Task] = {}
+        self.historial = historial
+        self.instantanea = instantanea
+        self.instantanea_cada = instantanea_cada
+        # Un detector vectorizado para todas las plantas (un tramo por planta)
+        self.detector = (
+            DetectorFugas(len(plantas))
+            if plantas and all(tramo_vigilado(s.sensores) for s in plantas.values())
+            else None
+        )
+
+    def on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            log.info("✅ MQTT Conectado (%s)", userdata)
+            # Solo la primera conexión recibe comandos, enrutados por id de planta
+            if userdata == 0:
+                client.subscribe("plantas/+/comandos")
+                log.info("🎛️  Escuchando comandos de %d plantas...", len(self.plantas))
+        else:
+            log.error("❌ Error MQTT: %s", rc)
+
+    def on_publish(self, client, userdata, mid):
+        # QoS 0: paho lo llama cuando el paquete terminó de escribirse en el socket
+        self._sin_escribir[userdata] -= 1
+        self._escritos.set()
+
+    def on_disconnect(self, client, userdata, rc):
+        # paho descarta los paquetes QoS 0 pendientes al perder la conexión
+        self._sin_escribir[userdata] = 0
+        self._escritos.set()
+        if rc != 0 and userdata not in self._reconectando:
+            log.error("❌ Conexión %s perdida (%s): reconectando", userdata, rc)
+            self._reconectando[userdata] = asyncio.get_running_loop().create_task(
+                self._reconectar(client, userdata)
+            )
+
+    async def _reconectar(self, client: mqtt.Client, conexion: int):
+        """Reintenta con espera exponencial (1 s a 30 s) hasta recuperar la conexión"""
+        espera = 1.0
+        try:
+            while True:
+                await asyncio.sleep(espera)
+                try:
+                    # Abre el socket nuevo: on_socket_open lo registra en el loop y on_connect resuscribe
+                    client.reconnect()
+                    log.info("🔌 Conexión %s restablecida (%d descartados hasta ahora)", conexion, self.descartados)
+                    return
+                except OSError as e:
+                    espera = min(espera * 2, 30.0)
+                    log.warning("⚠️  Reconexión %s fallida: %s (próximo intento en %.0f s)", conexion, e, espera)
+        finally:
+            self._reconectando.pop(conexion, None)
+
+    def on_message(self, client, userdata, msg):
+        """Enruta plantas/{id}/comandos a la planta correspondiente"""
+        try:
+            planta_id = msg.topic.split("/")[1]
+            sistema = self.plantas.get(planta_id)
+            if sistema is None:
+                log.warning("⚠️  Planta desconocida: %s", planta_id)
+                return
+            comando = json.loads(msg.payload.decode())
+            if not sistema.aplicar_comando(comando):
+                log.warning("⚠️  Comando desconocido para %s: %s", planta_id, comando)
+        except Exception as e:
+            log.error("❌ Error procesando comando: %s", e)
+
+    async def conectar(self):
+        """Abre el pool de conexiones integrado al event loop"""
+        loop = asyncio.get_running_loop()
+        self.cola = asyncio.Queue(maxsize=self.capacidad_cola)
+        self._escritos = asyncio.Event()
+        for i in range(self.n_conexiones):
+            client = mqtt.Client(callback_api_version=CallbackAPIVersion.VERSION1, userdata=i)
+            client.on_connect = self.on_connect
+            client.on_message = self.on_message
+            client.on_publish = self.on_publish
+            client.on_disconnect = self.on_disconnect
+            _PuenteAsyncio(loop, client)
+            # connect() dispara on_socket_open, que debe ejecutarse en el hilo del loop
+            client.connect(self.host, self.puerto, 60)
+            self.clientes.append(client)
+
+    async def publicador(self):
+        """Vacía la cola en lotes; la cola acotada frena a los productores"""
+        while True:
+            # Con el broker o el socket trabados la cola deja de vaciarse y put() frena a simular()
+            while sum(self._sin_escribir) >= self.max_sin_escribir:
+                self._escritos.clear()
+                await self._escritos.wait()
+            lote: List[Tuple[str, str]] = [await self.cola.get()]
+            while len(lote) < self.tamano_lote and not self.cola.empty():
+                lote.append(self.cola.get_nowait())
+            for topico, mensaje in lote:
+                planta_id = topico.split("/")[1]
+                conexion = self._conexion_de[planta_id]
+                # Se cuenta antes: si el socket acepta enseguida, on_publish corre dentro de publish()
+                self._sin_escribir[conexion] += 1
+                if self.clientes[conexion].publish(topico, mensaje).rc != mqtt.MQTT_ERR_SUCCESS:
+                    # Sin conexión paho no encola el mensaje QoS 0: se pierde y se cuenta
+                    self._sin_escribir[conexion] -= 1
+                    self.descartados += 1
+                else:
+                    self.publicados += 1
+                self.cola.task_done()
+            # Cede el loop para que los writers vacíen los sockets
+            await asyncio.sleep(0)
+
+    async def simular(self, periodo: float = 2.0):
+        """Avanza todas las plantas cada periodo y encola sus datos"""
+        loop = asyncio.get_running_loop()
+        tick = 0
+        while True:
+            inicio = loop.time()
+            ahora = time.time()
+            muestras = []
+            lote = []
+            for planta_id, sistema in self.plantas.items():
+                flujos = sistema.actualizar_sistema()
+                lote.append((planta_id, sistema.get_datos_mqtt(flujos)))
+                muestras.append(muestra(sistema, flujos))
+
+            if self.detector is not None:
+                arriba, abajo, con_flujo = (np.array(c) for c in zip(*muestras))
+                for alarma in self.detector.actualizar(ahora, arriba, abajo, con_flujo):
+                    planta_id = lote[alarma.pop("tramo")][0]
+                    alarma.update(tipo="fuga", planta=planta_id)
+                    await self.cola.put((f"plantas/{planta_id}/alarmas", json.dumps(alarma)))
+                    log.info("🚨 Alarma de fuga %s en %s", alarma["estado"], planta_id)
+
+            for i, (planta_id, datos) in enumerate(lote):
+                if self.detector is not None:
+                    datos["tomas_detectadas"] = bool(self.detector.en_alarma[i])
+                if self.historial is not None:
+                    self.historial.registrar(planta_id, ahora, datos)
+                # put() espera si la cola está llena (backpressure)
+                await self.cola.put((f"plantas/{planta_id}/datos", json.dumps(datos)))
+                if i % self.tamano_lote == 0:
+                    await asyncio.sleep(0)
+
+            tick += 1
+            if self.instantanea_cada and tick % self.instantanea_cada == 0:
+                self.guardar_instantanea()
+            duracion = loop.time() - inicio
+            if tick % 10 == 0:
+                log.info(
+                    "📊 Tick %d: %d plantas en %.0f ms, cola=%d, sin escribir=%d, publicados=%d, descartados=%d",
+                    tick,
+                    len(self.plantas),
+                    duracion * 1000,
+                    self.cola.qsize(),
+                    sum(self._sin_escribir),
+                    self.publicados,
+                    self.descartados,
+                )
+            await asyncio.sleep(max(0.0, periodo - duracion))
+
+    def guardar_instantanea(self):
+        """Estado de todas las plantas en un solo archivo, escrito de forma atómica"""
+        if self.instantanea:
+            tamano = instantanea.guardar(self.instantanea, self.plantas)
+            log.info("📸 Instantánea de %d plantas en %s (%d bytes)", len(self.plantas), self.instantanea, tamano)
+
+    def desconectar(self):
+        """Desconecta todas las conexiones del pool"""
+        for tarea in list(self._reconectando.values()):
+            tarea.cancel()
+        for client in self.clientes:
+            client.disconnect()
+
+
+async def ejecutar(args):
+    # Cada planta con su propio flujo de ruido, reproducible con --semilla
+    plantas = {
+        str(i): SistemaSimulacion(semilla=semilla)
+        for i, semilla in enumerate(semillas_por_planta(args.semilla, args.plantas))
+    }
+    if args.restaurar:
+        if os.path.exists(args.instantanea):
+            inicio = time.perf_counter()
+            restauradas = instantanea.restaurar(args.instantanea, plantas)
+            log.info(
+                "📂 %d plantas restauradas de %s en %.0f ms",
+                restauradas,
+                args.instantanea,
+                (time.perf_counter() - inicio) * 1000,
+            )
+        else:
+            log.warning("⚠️  %s no existe: arranque desde cero", args.instantanea)
+    historial = Historial(args.historial) if args.historial else None
+    gestor = GestorMQTTAsincrono(
+        plantas,
+        args.host,
+        args.puerto,
+        args.conexiones,
+        historial=historial,
+        instantanea=args.instantanea,
+        instantanea_cada=args.instantanea_cada,
+    )
+    await gestor.conectar()
+    log.info("🚀 %d plantas en un solo event loop (%d conexiones)", args.plantas, args.conexiones)
+    try:
+        await asyncio.gather(gestor.publicador(), gestor.simular(args.periodo))
+    finally:
+        gestor.desconectar()
+        if historial is not None:
+            historial.cerrar()
+        gestor.guardar_instantanea()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulador multi-planta sobre asyncio")
+    parser.add_argument("--plantas", type=int, default=100)
+    parser.add_argument("--conexiones", type=int, default=1)
+    parser.add_argument("--periodo", type=float, default=2.0, help="Segundos reales entre ticks")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--puerto", type=int, default=1883)
+    parser.add_argument("--semilla", type=int)
+    parser.add_argument("--historial", metavar="DIR", help="Grabar los frames de cada planta en DIR")
+    parser.add_argument(
+        "--instantanea", metavar="ARCHIVO", help="Instantánea de todas las plantas cada --instantanea-cada ticks y al salir"
+    )
+    parser.add_argument("--instantanea-cada", type=int, default=0, metavar="N")
+    parser.add_argument("--restaurar", action="store_true", help="Arrancar desde --instantanea si existe")
+    parser.add_argument("--log-nivel", default="INFO")
+    parser.add_argument("--log-formato", choices=["texto", "jsonl"], default="texto")
+    args = parser.parse_args()
+    if (args.restaurar or args.instantanea_cada) and not args.instantanea:
+        parser.error("--restaurar y --instantanea-cada requieren --instantanea")
+
+    listener = configurar_registro(args.log_nivel, args.log_formato)
+    try:
+        asyncio.run(ejecutar(args))
+    except KeyboardInterrupt:
+        log.info("🛑 Simulador detenido")
+    finally:
+        listener.stop()
+
+
+if __name__ == "__main__":
+    main()
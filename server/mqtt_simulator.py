@@ -1,13 +1,31 @@
 #!/usr/bin/env python3
 
+import argparse
 import json
+import logging
+import math
+import os
 import time
 import random
+import numpy as np
 import paho.mqtt.client as mqtt
 from paho.mqtt.client import CallbackAPIVersion
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from dataclasses import dataclass, asdict
 
+from cola_comandos import ColaComandos
+import detector_fugas
+from historial import Historial
+import instantanea
+from metricas import Metricas, servir_prometheus
+from publicacion_deltas import PublicadorDeltas
+from registro import configurar_registro
+from ruido import RuidoBloques
+from telemetria_binaria import CodificadorBinario, MedidorFormato, medir
+from topologia import RedHidraulica, Topologia, cargar_topologia
+
+log = logging.getLogger("simulador")
+
 
 @dataclass
 class Valvula:
@@ -22,23 +40,36 @@ class Valvula:
             return 0.0
         return (self.presion / 100.0) * self.flujo_max
 
-    def actualizar_presion(self, hay_flujo_real=False):
+    def actualizar_presion(self, hay_flujo_real=False, ruido=random):
         """Actualiza la presión con variación realista basada en flujo real"""
         if self.estado and hay_flujo_real:
             # Válvula abierta CON flujo real: presión alta y fluctuante
-            variacion = random.uniform(-1.0, 1.0)
+            variacion = ruido.uniform(-1.0, 1.0)
             self.presion = max(75.0, min(85.0, self.presion + variacion))
         elif self.estado and not hay_flujo_real:
             # Válvula abierta SIN flujo: presión media (agua estancada)
-            variacion = random.uniform(-0.3, 0.3)
+            variacion = ruido.uniform(-0.3, 0.3)
             self.presion = max(15.0, min(25.0, self.presion + variacion))
         else:
             # Válvula cerrada: presión interna prácticamente 0 (físicamente correcto)
-            self.presion = max(0.0, min(0.5, random.uniform(0.0, 0.5)))
+            self.presion = max(0.0, min(0.5, ruido.uniform(0.0, 0.5)))
 
 
 # Tomas clandestinas removidas - solo se simularán alertas visuales
 
+# Paso adaptativo: variación máxima de nivel por paso (fracción de la capacidad)
+VARIACION_MAXIMA_PASO = 0.02
+# Periodo máximo aceptado por el comando "periodo" (segundos reales entre ticks)
+PERIODO_MAXIMO = 3600.0
+# Nivel por debajo del cual los tanques izquierdos dejan de descargar (modelo de 4 tanques)
+NIVEL_MINIMO_SALIDA = 5
+
+
+def periodo_valido(periodo: float) -> bool:
+    """Periodo aceptable para el comando "periodo": finito, positivo y a lo sumo PERIODO_MAXIMO"""
+    # NaN deja el bucle sin esperar e inf desborda la espera del próximo tick
+    return math.isfinite(periodo) and 0 < periodo <= PERIODO_MAXIMO
+
 
 @dataclass
 class Tanque:
@@ -68,50 +99,24 @@ class Tanque:
 
 
 class SistemaSimulacion:
-    def __init__(self):
+    def __init__(self, topologia: Optional[Topologia] = None, semilla=None):
+        # Tanques, válvulas y sensores salen de la topología (por defecto la planta de 4 tanques:
+        # izquierdos llenos, derechos vacíos, todas las válvulas cerradas, sensores en 0)
+        self.topologia = topologia or cargar_topologia()
+
         self.valvulas = {
-            1: Valvula(
-                1, 3.0, False
-            ),  # Válvula 1: controla flujo hacia tanques derecha
-            2: Valvula(
-                2, 3.0, False
-            ),  # Válvula 2: controla flujo independiente hacia tanques derecha
-            3: Valvula(
-                3, 2.0, False
-            ),  # Válvula 3: entrada tanque izquierdo 1
-            4: Valvula(
-                4, 2.0, False
-            ),  # Válvula 4: entrada tanque izquierdo 2
-            5: Valvula(
-                5, 2.0, False
-            ),  # Válvula 5: entrada tanque derecho 1
-            6: Valvula(
-                6, 2.0, False
-            ),  # Válvula 6: entrada tanque derecho 2
+            v.id: Valvula(v.id, v.presion, v.estado) for v in self.topologia.valvulas
         }
 
         self.tanques = {
-            "tanque_izq_1": Tanque(
-                "Tanque Izq 1", 1000.0, 1000.0
-            ),  # Tanques izquierdos empiezan llenos al máximo
-            "tanque_izq_2": Tanque(
-                "Tanque Izq 2", 1000.0, 1000.0
-            ),  # Tanques izquierdos empiezan llenos al máximo
-            "tanque_der_1": Tanque(
-                "Tanque Der 1", 1000.0, 0.0
-            ),  # Tanques derechos empiezan vacíos
-            "tanque_der_2": Tanque(
-                "Tanque Der 2", 1000.0, 0.0
-            ),  # Tanques derechos empiezan vacíos
+            t.id: Tanque(t.nombre, t.capacidad, t.nivel) for t in self.topologia.tanques
         }
 
         # Sensores de presión independientes - empiezan en 0
-        self.sensores = {
-            "sensor_pre_v1": {"presion": 0.0},
-            "sensor_post_v1": {"presion": 0.0},
-            "sensor_pre_v2": {"presion": 0.0},
-            "sensor_post_v2": {"presion": 0.0},
-        }
+        self.sensores = {s.id: {"presion": 0.0} for s in self.topologia.sensores}
+
+        # Topologías generales se resuelven sobre el grafo; la de 4 tanques usa la lógica en serie
+        self.red = RedHidraulica(self.topologia) if self.topologia.modelo == "red" else None
 
         # Tomas clandestinas removidas - solo alertas simuladas
         
@@ -119,10 +124,30 @@ class SistemaSimulacion:
         self.simulando_fuga = False
         self.fuga_intensidad = 0.0
 
+        # Control de ejecución: pausa, pasos individuales y segundos reales por tick
+        self.pausado = False
+        self.pasos_pendientes = 0
+        self.periodo = 2.0
+
         self.flujo_base = 3.0  # Reducir velocidad del flujo
 
+        # Fuente de ruido: cualquier objeto con uniform(a, b); por defecto un generador propio
+        # sembrado con `semilla` (entero o SeedSequence), independiente del módulo random
+        self.ruido = RuidoBloques(semilla)
+
+        # Temporizadores por fase opcionales (metricas.Metricas)
+        self.metricas = None
+
+        # Segundos simulados en el último actualizar_sistema (varía con paso adaptativo)
+        self.ultimo_dt = 2.0
+
+        # Archivo de los comandos instantanea/restaurar (no se acepta una ruta por MQTT)
+        self.ruta_instantanea: Optional[str] = None
+
     def calcular_flujos(self):
         """Calcula los flujos del nuevo sistema EN SERIE - ambas válvulas deben estar abiertas"""
+        if self.red is not None:
+            return self.red.calcular_flujos(self)
 
         # Obtener tanques
         izq1 = self.tanques["tanque_izq_1"]
@@ -149,8 +174,8 @@ class SistemaSimulacion:
         valvulas_principales_abiertas = self.valvulas[1].estado and self.valvulas[2].estado
         
         # Verificar válvulas de salida de tanques izquierdos (3 y 4)
-        puede_salir_izq1 = self.valvulas[3].estado and izq1.nivel_actual > 5
-        puede_salir_izq2 = self.valvulas[4].estado and izq2.nivel_actual > 5
+        puede_salir_izq1 = self.valvulas[3].estado and izq1.nivel_actual > NIVEL_MINIMO_SALIDA
+        puede_salir_izq2 = self.valvulas[4].estado and izq2.nivel_actual > NIVEL_MINIMO_SALIDA
         hay_salida_disponible = puede_salir_izq1 or puede_salir_izq2
         
         # Verificar válvulas de entrada de tanques derechos (5 y 6)
@@ -225,14 +250,14 @@ class SistemaSimulacion:
                         flujos["flujo_total"] = flujo_total
 
             # Calcular presiones del sistema - SIN FUGA las presiones son similares
-            presion_pre_v1 = presion_base_tuberia + random.uniform(-2, 2)
-            presion_post_v1 = presion_pre_v1 * 0.98 + random.uniform(-0.5, 0.5)  # Pérdida mínima sin fuga
+            presion_pre_v1 = presion_base_tuberia + self.ruido.uniform(-2, 2)
+            presion_post_v1 = presion_pre_v1 * 0.98 + self.ruido.uniform(-0.5, 0.5)  # Pérdida mínima sin fuga
 
             # Calcular presión antes de V2 - similar a post-v1 sin fuga
-            presion_pre_v2 = presion_post_v1 * 0.98 + random.uniform(-0.5, 0.5)
+            presion_pre_v2 = presion_post_v1 * 0.98 + self.ruido.uniform(-0.5, 0.5)
 
             # Presión después de V2 - similar a pre-v2 sin fuga
-            presion_post_v2 = presion_pre_v2 * 0.98 + random.uniform(-0.5, 0.5)
+            presion_post_v2 = presion_pre_v2 * 0.98 + self.ruido.uniform(-0.5, 0.5)
 
             # Aplicar efectos de fuga SOLO si está activa
             if self.simulando_fuga:
@@ -254,23 +279,23 @@ class SistemaSimulacion:
             if self.valvulas[1].estado:
                 # V1 abierta pero V2 cerrada o sin líquido: presión se acumula antes de V2
                 self.sensores["sensor_pre_v1"]["presion"] = max(
-                    0, presion_base_tuberia * 0.6 + random.uniform(-1, 1)
+                    0, presion_base_tuberia * 0.6 + self.ruido.uniform(-1, 1)
                 )
                 self.sensores["sensor_post_v1"]["presion"] = max(
-                    0, presion_base_tuberia * 0.5 + random.uniform(-1, 1)
+                    0, presion_base_tuberia * 0.5 + self.ruido.uniform(-1, 1)
                 )
 
                 if self.valvulas[2].estado:
                     # V1 abierta, V2 abierta, pero no hay suficiente líquido
                     self.sensores["sensor_pre_v2"]["presion"] = max(
-                        0, presion_base_tuberia * 0.3 + random.uniform(-1, 1)
+                        0, presion_base_tuberia * 0.3 + self.ruido.uniform(-1, 1)
                     )
                     # Sin flujo real = presión cero después de V2
                     self.sensores["sensor_post_v2"]["presion"] = 0.0
                 else:
                     # V1 abierta, V2 CERRADA: presión se acumula antes de V2, CERO después
                     self.sensores["sensor_pre_v2"]["presion"] = max(
-                        0, presion_base_tuberia * 0.4 + random.uniform(-1, 1)
+                        0, presion_base_tuberia * 0.4 + self.ruido.uniform(-1, 1)
                     )
                     # V2 cerrada = presión 0 después de la válvula
                     self.sensores["sensor_post_v2"]["presion"] = 0.0
@@ -278,7 +303,7 @@ class SistemaSimulacion:
                 # V1 CERRADA: sin flujo en todo el sistema
                 # Presión residual antes de V1 (de tanques)
                 self.sensores["sensor_pre_v1"]["presion"] = max(
-                    0, presion_base_tuberia * 0.2 + random.uniform(-0.5, 0.5)
+                    0, presion_base_tuberia * 0.2 + self.ruido.uniform(-0.5, 0.5)
                 )
                 # V1 cerrada = presión 0 en todo el sistema después de V1
                 self.sensores["sensor_post_v1"]["presion"] = 0.0
@@ -287,51 +312,174 @@ class SistemaSimulacion:
 
         return flujos
 
-    def actualizar_sistema(self):
-        """Actualiza todo el sistema"""
+    def actualizar_sistema(self, dt: float = 2.0, dt_max: Optional[float] = None):
+        """Actualiza todo el sistema avanzando dt segundos; con dt_max el paso se adapta
+        entre dt y dt_max (ver paso_adaptativo) y queda en ultimo_dt"""
+        metricas = self.metricas
+        if metricas is not None:
+            inicio = time.perf_counter_ns()
+
         # Calcular flujos
         flujos = self.calcular_flujos()
+        if metricas is not None:
+            fin_flujos = time.perf_counter_ns()
+            metricas.registrar("calcular_flujos", fin_flujos - inicio)
+
+        # En la red, la presión de las válvulas sale de la solución del grafo
+        if self.red is None:
+            # Determinar si hay flujo real (solo cuando ambas válvulas están abiertas)
+            hay_flujo_real = flujos["flujo_total"] > 0
+            valvulas_en_serie = self.valvulas[1].estado and self.valvulas[2].estado
 
-        # Determinar si hay flujo real (solo cuando ambas válvulas están abiertas)
-        hay_flujo_real = flujos["flujo_total"] > 0
-        valvulas_en_serie = self.valvulas[1].estado and self.valvulas[2].estado
+            # Actualizar válvulas con información de flujo real
+            self.valvulas[1].actualizar_presion(hay_flujo_real and valvulas_en_serie, self.ruido)
+            self.valvulas[2].actualizar_presion(hay_flujo_real and valvulas_en_serie, self.ruido)
 
-        # Actualizar válvulas con información de flujo real
-        self.valvulas[1].actualizar_presion(hay_flujo_real and valvulas_en_serie)
-        self.valvulas[2].actualizar_presion(hay_flujo_real and valvulas_en_serie)
+        if dt_max is not None:
+            dt = self.paso_adaptativo(dt, dt_max)
+        self.ultimo_dt = dt
 
         # Actualizar tanques
         for tanque in self.tanques.values():
-            tanque.actualizar_nivel()
+            tanque.actualizar_nivel(dt)
+        if metricas is not None:
+            metricas.registrar("actualizar_nivel", time.perf_counter_ns() - fin_flujos)
 
         return flujos
 
+    def en_reposo(self) -> bool:
+        """True si ningún tanque tiene flujo: los niveles no cambian hasta el próximo comando"""
+        return all(t.flujo_entrada == 0 and t.flujo_salida == 0 for t in self.tanques.values())
+
+    def paso_adaptativo(self, dt_min: float, dt_max: float) -> float:
+        """Paso para los flujos actuales: dt_max en reposo; con flujo, el mayor que no varía un nivel
+        más de VARIACION_MAXIMA_PASO ni recorre más de la mitad de lo que le falta para llenarse
+        o vaciarse (acercándose al evento), sin bajar de dt_min salvo que dt_max sea menor o que
+        haga falta para cortar la descarga justo en NIVEL_MINIMO_SALIDA"""
+        paso = dt_max
+        # En el modelo de 4 tanques la descarga se corta en NIVEL_MINIMO_SALIDA, no en 0
+        corte = NIVEL_MINIMO_SALIDA if self.red is None else 0.0
+        hasta_corte = math.inf
+        for tanque in self.tanques.values():
+            neto = tanque.flujo_entrada - tanque.flujo_salida
+            if neto == 0:
+                continue
+            if neto > 0:
+                margen = tanque.capacidad - tanque.nivel_actual
+            elif tanque.nivel_actual > corte:
+                margen = tanque.nivel_actual - corte
+                if corte:
+                    # Apenas por debajo del umbral: con el nivel exacto el redondeo podría dejarlo encima
+                    hasta_corte = min(hasta_corte, (margen + 1e-6) / -neto)
+            else:
+                margen = tanque.nivel_actual
+            paso = min(paso, VARIACION_MAXIMA_PASO * tanque.capacidad / abs(neto), 0.5 * margen / abs(neto))
+        return min(dt_max, max(dt_min, paso), hasta_corte)
+
     def cambiar_valvula(self, valvula_id: int, nuevo_estado: bool):
         """Cambia el estado de una válvula"""
         if valvula_id in self.valvulas:
             self.valvulas[valvula_id].estado = nuevo_estado
-            print(f"🔧 Válvula {valvula_id} {'ABIERTA' if nuevo_estado else 'CERRADA'}")
+            log.info("🔧 Válvula %s %s", valvula_id, "ABIERTA" if nuevo_estado else "CERRADA")
         else:
-            print(
-                f"⚠️  ID de válvula inválido: {valvula_id} (válvulas disponibles: 1-6)"
+            log.warning(
+                "⚠️  ID de válvula inválido: %s (válvulas disponibles: %s)", valvula_id, list(self.valvulas)
             )
     
     def simular_fuga(self, intensidad: float = 5.0):
         """Simula una fuga en el tramo entre post-v1 y pre-v2"""
         self.simulando_fuga = True
         self.fuga_intensidad = intensidad
-        print(f"💧 Simulando fuga con intensidad {intensidad}")
+        log.info("💧 Simulando fuga con intensidad %s", intensidad)
     
     def detener_fuga(self):
         """Detiene la simulación de fuga"""
         self.simulando_fuga = False
         self.fuga_intensidad = 0.0
-        print("✅ Fuga detenida")
+        log.info("✅ Fuga detenida")
+
+    def guardar_instantanea(self, ruta: Optional[str] = None):
+        """Guarda el estado completo (incluido el del ruido) de forma atómica"""
+        ruta = ruta or self.ruta_instantanea
+        if ruta is None:
+            log.warning("⚠️  Sin archivo de instantáneas configurado (--instantanea)")
+            return
+        tamano = instantanea.guardar(ruta, {self.topologia.nombre: self})
+        log.info("📸 Instantánea guardada en %s (%d bytes)", ruta, tamano)
+
+    def restaurar_instantanea(self, ruta: Optional[str] = None):
+        """Carga el estado guardado por guardar_instantanea; la simulación sigue exactamente desde ahí"""
+        ruta = ruta or self.ruta_instantanea
+        if ruta is None:
+            log.warning("⚠️  Sin archivo de instantáneas configurado (--instantanea)")
+            return
+        if instantanea.restaurar(ruta, {self.topologia.nombre: self}) == 0:
+            log.warning("⚠️  %s no contiene la planta %s", ruta, self.topologia.nombre)
+            return
+        log.info("📂 Estado restaurado de %s", ruta)
+
+    def aplicar_comando(self, comando: Dict[str, Any]) -> bool:
+        """Aplica un comando en formato MQTT; devuelve False si no se reconoce"""
+        # Formato nuevo: {"tipo": "valvula", "id": 1, "estado": true}
+        if comando.get("tipo") == "valvula":
+            self.cambiar_valvula(comando.get("id"), comando.get("estado"))
+
+        # Formato legacy: {"comando": "valvula1", "valor": true}
+        elif comando.get("comando") in ["valvula1", "valvula2", "valvula3", "valvula4", "valvula5", "valvula6"]:
+            valvula_num = int(comando.get("comando").replace("valvula", ""))
+            self.cambiar_valvula(valvula_num, comando.get("valor"))
+
+        # Comando de pausa: sin "valor" alterna (así lo envía el dashboard)
+        elif comando.get("comando") == "pausar":
+            valor = comando.get("valor")
+            self.pausado = (not self.pausado) if valor is None else bool(valor)
+            self.pasos_pendientes = 0
+            log.info("🔄 Sistema %s", "PAUSADO" if self.pausado else "REANUDADO")
+
+        elif comando.get("comando") == "reanudar":
+            self.pausado = False
+            self.pasos_pendientes = 0
+            log.info("🔄 Sistema REANUDADO")
+
+        # Avanzar N ticks estando en pausa: {"comando": "paso", "n": 1}
+        elif comando.get("comando") == "paso":
+            self.pasos_pendientes += max(1, int(comando.get("n", 1)))
+            log.info("⏭️  %d paso(s) pendiente(s)", self.pasos_pendientes)
+
+        # Segundos reales entre ticks: {"comando": "periodo", "valor": 0.5}
+        elif comando.get("comando") == "periodo":
+            periodo = float(comando.get("valor"))
+            if not periodo_valido(periodo):
+                log.warning("⚠️  Periodo inválido: %s (debe estar entre 0 y %s s)", periodo, PERIODO_MAXIMO)
+            else:
+                self.periodo = periodo
+                log.info("⏱️  Periodo de simulación: %ss por tick", periodo)
+
+        # Comandos de fuga
+        elif comando.get("comando") == "simular_fuga":
+            self.simular_fuga(comando.get("intensidad", 5.0))
+
+        elif comando.get("comando") == "detener_fuga":
+            self.detener_fuga()
+
+        # Instantáneas en el archivo configurado: {"comando": "instantanea"} / {"comando": "restaurar"}
+        elif comando.get("comando") == "instantanea":
+            self.guardar_instantanea()
+
+        elif comando.get("comando") == "restaurar":
+            self.restaurar_instantanea()
+
+        # Comandos de tomas clandestinas removidos - solo alertas visuales simuladas
+        else:
+            return False
+        return True
 
     # Método cambiar_toma_clandestina removido - solo alertas simuladas
 
     def get_datos_mqtt(self, flujos: Dict[str, float]) -> Dict[str, Any]:
         """Genera los datos para enviar por MQTT en el nuevo formato"""
+        if self.red is not None:
+            return self.get_datos_red(flujos)
         return {
             # Tanques - nuevo formato
             "tanque_izq_1": round(self.tanques["tanque_izq_1"].nivel_actual, 1),
@@ -366,63 +514,103 @@ class SistemaSimulacion:
             "sistema_activo": any(v.estado for v in self.valvulas.values()),
             "flujos": flujos,
             "flujo_total": round(sum(flujos.values()), 2),
-            # Detección de tomas clandestinas - siempre falso
+            # Detección de tomas clandestinas: la fija el detector de fugas del lazo principal
             "tomas_detectadas": False,
         }
 
 
+    def get_datos_red(self, flujos: Dict[str, float]) -> Dict[str, Any]:
+        """Payload genérico para topologías de red: un campo por tanque, válvula y sensor"""
+        datos: Dict[str, Any] = {
+            tanque_id: round(tanque.nivel_actual, 1) for tanque_id, tanque in self.tanques.items()
+        }
+        for valvula_id, valvula in self.valvulas.items():
+            datos[f"valvula{valvula_id}_estado"] = valvula.estado
+            datos[f"valvula{valvula_id}_presion_interna"] = round(valvula.presion, 1)
+        for sensor_id, sensor in self.sensores.items():
+            datos[sensor_id] = round(sensor["presion"], 1)
+        datos.update({
+            "sistema_activo": any(v.estado for v in self.valvulas.values()),
+            "simulando_fuga": self.simulando_fuga,
+            "flujos": flujos,
+            "flujo_total": round(flujos["flujo_total"], 2),
+        })
+        return datos
+
+
+# Segundos entre heartbeats en tanques/estado mientras el sistema está en pausa
+INTERVALO_HEARTBEAT = 5.0
+
+
 class MQTTManager:
-    def __init__(self, sistema: SistemaSimulacion):
+    def __init__(
+        self,
+        sistema: SistemaSimulacion,
+        binario: bool = False,
+        intervalo_keyframe: int = 0,
+        banda_muerta: float = 0.0,
+        metricas: Optional[Metricas] = None,
+    ):
         self.sistema = sistema
+        self.metricas = metricas
+        # Mensajes entregados a paho vs. escritos al socket (on_publish): profundidad de la cola de salida
+        self.publicados = 0
+        self.confirmados = 0
+        # Comandos recibidos en el hilo de paho; se aplican al inicio de cada tick
+        self.comandos = ColaComandos()
+        # Publicación delta opcional en tópico paralelo (keyframe cada N ticks)
+        self.deltas = (
+            PublicadorDeltas(intervalo_keyframe, banda_muerta) if intervalo_keyframe > 0 else None
+        )
+        self.medidor_delta = MedidorFormato()
+        # Telemetría binaria opcional en tópico paralelo (el JSON no cambia)
+        self.codificador = CodificadorBinario() if binario else None
+        self.medidor_json = MedidorFormato()
+        self.medidor_binario = MedidorFormato()
         self.client = mqtt.Client(callback_api_version=CallbackAPIVersion.VERSION1)
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
+        self.client.on_publish = self.on_publish
 
     def on_connect(self, client, userdata, flags, rc):
         if rc == 0:
-            print("✅ MQTT Conectado")
+            log.info("✅ MQTT Conectado")
             # Suscribirse a comandos de válvulas
             client.subscribe("tanques/comandos")
-            print("🎛️  Escuchando comandos...")
+            log.info("🎛️  Escuchando comandos...")
+            if self.codificador:
+                self._publicar("tanques/datos/bin/esquema", self.codificador.descriptor(), retain=True)
+                log.info("📦 Telemetría binaria en tanques/datos/bin")
+            if self.deltas:
+                client.subscribe("tanques/datos/delta/resync")
+                # Tras (re)conectar los suscriptores necesitan un estado completo
+                self.deltas.solicitar_keyframe()
+                log.info("🔺 Publicación delta en tanques/datos/delta")
         else:
-            print(f"❌ Error MQTT: {rc}")
+            log.error("❌ Error MQTT: %s", rc)
+
+    def on_publish(self, client, userdata, mid):
+        self.confirmados += 1
+
+    def cola_publicacion(self) -> int:
+        return self.publicados - self.confirmados
 
     def on_message(self, client, userdata, msg):
         """Maneja comandos recibidos"""
+        if msg.topic == "tanques/datos/delta/resync":
+            log.info("🔺 Resync solicitado: keyframe en el próximo tick")
+            self.deltas.solicitar_keyframe()
+            return
+
         try:
             comando = json.loads(msg.payload.decode())
-            print(f"📨 Comando recibido: {comando}")
-            
-            # Formato nuevo: {"tipo": "valvula", "id": 1, "estado": true}
-            if comando.get("tipo") == "valvula":
-                valvula_id = comando.get("id")
-                estado = comando.get("estado")
-                self.sistema.cambiar_valvula(valvula_id, estado)
-            
-            # Formato legacy: {"comando": "valvula1", "valor": true}
-            elif comando.get("comando") in ["valvula1", "valvula2", "valvula3", "valvula4", "valvula5", "valvula6"]:
-                valvula_num = int(comando.get("comando").replace("valvula", ""))
-                self.sistema.cambiar_valvula(valvula_num, comando.get("valor"))
-            
-            # Comando de pausa
-            elif comando.get("comando") == "pausar":
-                self.sistema.pausado = comando.get("valor")
-                print(f"🔄 Sistema {'PAUSADO' if comando.get('valor') else 'REANUDADO'}")
-            
-            # Comandos de fuga
-            elif comando.get("comando") == "simular_fuga":
-                intensidad = comando.get("intensidad", 5.0)
-                self.sistema.simular_fuga(intensidad)
-            
-            elif comando.get("comando") == "detener_fuga":
-                self.sistema.detener_fuga()
-            
-            # Comandos de tomas clandestinas removidos - solo alertas visuales simuladas
-            else:
-                print(f"⚠️  Comando desconocido: {comando}")
-                
+            log.debug("📨 Comando recibido: %s", comando)
+
+            if not self.comandos.encolar(comando):
+                log.warning("⚠️  Cola de comandos llena, descartado: %s", comando)
+
         except Exception as e:
-            print(f"❌ Error procesando comando: {e}")
+            log.error("❌ Error procesando comando: %s", e)
 
     def conectar(self):
         """Conecta al broker MQTT"""
@@ -431,93 +619,353 @@ class MQTTManager:
             self.client.loop_start()
             return True
         except Exception as e:
-            print(f"❌ Error conectando: {e}")
+            log.error("❌ Error conectando: %s", e)
             return False
 
     def publicar_datos(self, datos: Dict[str, Any]):
         """Publica datos del sistema"""
-        mensaje = json.dumps(datos)
-        self.client.publish("tanques/datos", mensaje)
+        mensaje, ns = medir(json.dumps, datos)
+        self.medidor_json.registrar(len(mensaje), ns)
+        if self.metricas is not None:
+            self.metricas.registrar("json_dumps", ns)
+        self._publicar("tanques/datos", mensaje)
+
+        if self.codificador:
+            frame, ns = medir(self.codificador.codificar, datos)
+            self.medidor_binario.registrar(len(frame), ns)
+            self._publicar("tanques/datos/bin", frame)
+
+        if self.deltas:
+            delta = self.deltas.siguiente_mensaje(datos)
+            if delta is not None:
+                mensaje, ns = medir(json.dumps, delta)
+                self.medidor_delta.registrar(len(mensaje), ns)
+                self._publicar("tanques/datos/delta", mensaje)
+
+    def _publicar(self, topico: str, mensaje, retain: bool = False):
+        self.publicados += 1
+        self.client.publish(topico, mensaje, retain=retain)
+
+    def publicar_alarma(self, alarma: Dict[str, Any]):
+        """Publica un evento de alarma (activada o despejada) en tanques/alarmas"""
+        self._publicar("tanques/alarmas", json.dumps(alarma))
+
+    def publicar_stats(self):
+        """Publica el resumen de métricas en tanques/stats"""
+        self._publicar("tanques/stats", json.dumps(self.metricas.resumen()))
+
+    def publicar_heartbeat(self, tick: int):
+        """Publica el estado de control mientras no se publican datos"""
+        estado = {
+            "pausado": self.sistema.pausado,
+            "tick": tick,
+            "periodo": self.sistema.periodo,
+            "timestamp": time.time(),
+        }
+        self._publicar("tanques/estado", json.dumps(estado), retain=True)
 
     def desconectar(self):
         """Desconecta del broker"""
         self.client.disconnect()
 
 
-def main():
+def registrar_estado(sistema: SistemaSimulacion, datos: Dict[str, Any], flujos: Dict[str, float], tick: int):
+    """Registra el resumen de estado del sistema de 4 tanques (texto + campos estructurados)"""
+    if sistema.red is not None:
+        log.info(
+            "📊 %s: %d tanques, flujo total %.2f L/s",
+            sistema.topologia.nombre,
+            len(sistema.tanques),
+            datos["flujo_total"],
+            extra={"campos": {"tick": tick, "estado": {k: v for k, v in datos.items() if k != "flujos"}}},
+        )
+        return
+
+    # Información de tanques
+    izq1 = datos["tanque_izq_1"]
+    izq2 = datos["tanque_izq_2"]
+    der1 = datos["tanque_der_1"]
+    der2 = datos["tanque_der_2"]
+
+    # Indicadores de estado de válvulas
+    v1_flujo = flujos.get("flujo_v1", 0) > 0
+    v2_flujo = flujos.get("flujo_v2", 0) > 0
+
+    v1_estado = (
+        "🟢💧"
+        if (sistema.valvulas[1].estado and v1_flujo)
+        else "🟢⚪" if sistema.valvulas[1].estado else "🔴"
+    )
+    v2_estado = (
+        "🟢💧"
+        if (sistema.valvulas[2].estado and v2_flujo)
+        else "🟢⚪" if sistema.valvulas[2].estado else "🔴"
+    )
+
+    # Porcentajes de llenado
+    izq1_pct = (izq1 / 1000.0) * 100
+    izq2_pct = (izq2 / 1000.0) * 100
+    der1_pct = (der1 / 1000.0) * 100
+    der2_pct = (der2 / 1000.0) * 100
+
+    log.info(
+        f"📊 {'[ACTIVO]' if datos['sistema_activo'] else '[INACTIVO]'} "
+        f"Izq: T1={izq1}L({izq1_pct:.0f}%), T2={izq2}L({izq2_pct:.0f}%) | Der: T1={der1}L({der1_pct:.0f}%), T2={der2}L({der2_pct:.0f}%) | "
+        f"V1={v1_estado}({datos['valvula1_presion_interna']:.1f}kPa) V2={v2_estado}({datos['valvula2_presion_interna']:.1f}kPa) | "
+        f"Pre-V1={datos['sensor_pre_v1']:.1f}kPa, Post-V1={datos['sensor_post_v1']:.1f}kPa, Pre-V2={datos['sensor_pre_v2']:.1f}kPa, Post-V2={datos['sensor_post_v2']:.1f}kPa",
+        extra={"campos": {"tick": tick, "estado": {k: v for k, v in datos.items() if k != "flujos"}}},
+    )
+
+
+def ejecutar(args: argparse.Namespace, topologia: Topologia):
+    """Bucle principal del simulador en vivo"""
     # Inicializar sistema
-    sistema = SistemaSimulacion()
-    mqtt_manager = MQTTManager(sistema)
+    sistema = SistemaSimulacion(topologia)
+    sistema.ruta_instantanea = args.instantanea
+    if args.restaurar:
+        if os.path.exists(args.instantanea):
+            sistema.restaurar_instantanea()
+        else:
+            log.warning("⚠️  %s no existe: arranque desde cero", args.instantanea)
+    metricas = Metricas() if args.metricas_puerto or args.stats_cada else None
+    sistema.metricas = metricas
+    mqtt_manager = MQTTManager(
+        sistema,
+        binario=args.binario,
+        intervalo_keyframe=args.delta,
+        banda_muerta=args.banda_muerta,
+        metricas=metricas,
+    )
+
+    if metricas is not None:
+        comandos = mqtt_manager.comandos
+        metricas.incrementar("ticks_total", 0)
+        metricas.incrementar("ticks_excedidos_total", 0)
+        metricas.observar("cola_publicacion", mqtt_manager.cola_publicacion)
+        metricas.observar("cola_comandos", comandos.pendientes)
+        metricas.observar("comandos_recibidos_total", lambda: comandos.recibidos, "counter")
+        metricas.observar("comandos_aplicados_total", lambda: comandos.aplicados, "counter")
+        metricas.observar("comandos_descartados_total", lambda: comandos.descartados, "counter")
+        metricas.observar("periodo_segundos", lambda: sistema.periodo)
+        if args.metricas_puerto:
+            servir_prometheus(metricas, args.metricas_puerto)
+            log.info("📈 Métricas en http://127.0.0.1:%d/metrics", args.metricas_puerto)
+
+    historial = Historial(args.historial) if args.historial else None
+    # Detector de fugas sobre el tramo post-V1 -> pre-V2 (si la topología tiene esos sensores)
+    detector = detector_fugas.DetectorFugas(1) if detector_fugas.tramo_vigilado(sistema.sensores) else None
+    if detector is not None and metricas is not None:
+        metricas.observar("alarmas_total", lambda: detector.alarmas, "counter")
 
     if not mqtt_manager.conectar():
         return
 
-    print("🚀 Simulador del nuevo sistema de 4 tanques iniciado...")
-    print("📊 Sistema: 2 tanques izquierda → 2 válvulas → 2 tanques derecha")
-    print("🔧 Control: Válvulas independientes con sensores de presión")
-    print("🎛️  Control bidireccional de válvulas habilitado")
-
+    if sistema.red is None:
+        log.info("🚀 Simulador del nuevo sistema de 4 tanques iniciado...")
+        log.info("📊 Sistema: 2 tanques izquierda → 2 válvulas → 2 tanques derecha")
+    else:
+        log.info("🚀 Simulador de la red %s iniciado...", topologia.nombre)
+        log.info(
+            "📊 Sistema: %d tanques, %d uniones, %d tuberías",
+            len(topologia.tanques),
+            len(topologia.nodos),
+            len(topologia.tuberias),
+        )
+    log.info("🔧 Control: Válvulas independientes con sensores de presión")
+    log.info("🎛️  Control bidireccional de válvulas habilitado")
+
+    tick = 0
+    proximo_tick = time.monotonic()
     try:
         while True:
+            # Aplicar comandos pendientes en el límite del tick (toman efecto en el siguiente)
+            aplicados = mqtt_manager.comandos.aplicar(sistema, tick + 1)
+            # En reposo un comando puede poner el sistema en marcha: no esperar al intervalo largo
+            if aplicados and args.reposo and sistema.en_reposo():
+                proximo_tick = min(proximo_tick, time.monotonic())
+            for pendiente in aplicados:
+                log.debug(
+                    "⏱️  Comando aplicado en tick %d (%.1f ms)",
+                    tick + 1,
+                    pendiente.latencia * 1000,
+                    extra={"campos": {"tick": tick + 1, "latencia_ms": pendiente.latencia * 1000}},
+                )
+
+            # En pausa: solo heartbeat, bloqueado hasta el próximo comando
+            if sistema.pausado and sistema.pasos_pendientes == 0:
+                mqtt_manager.publicar_heartbeat(tick)
+                mqtt_manager.comandos.esperar(INTERVALO_HEARTBEAT)
+                proximo_tick = time.monotonic()
+                continue
+
+            # Esperar al próximo tick; un comando despierta antes para aplicarse
+            restante = proximo_tick - time.monotonic()
+            if restante > 0:
+                mqtt_manager.comandos.esperar(restante)
+                continue
+
+            if sistema.pausado:
+                sistema.pasos_pendientes -= 1
+            tick += 1
+            inicio_tick = time.perf_counter_ns()
+
             # Actualizar sistema
             flujos = sistema.actualizar_sistema()
 
+            intervalo = sistema.periodo
+            if args.reposo and sistema.en_reposo():
+                intervalo = max(intervalo, args.reposo)
+            proximo_tick = max(proximo_tick + intervalo, time.monotonic())
+
+            # Detección de fugas en línea
+            if detector is not None:
+                td = time.perf_counter_ns()
+                arriba, abajo, con_flujo = detector_fugas.muestra(sistema, flujos)
+                ahora = time.time()
+                for alarma in detector.actualizar(ahora, np.array([arriba]), np.array([abajo]), np.array([con_flujo])):
+                    alarma.update(tipo="fuga", planta=topologia.nombre)
+                    alarma.pop("tramo")
+                    mqtt_manager.publicar_alarma(alarma)
+                    if alarma["estado"] == "activa":
+                        log.warning(
+                            "🚨 Fuga detectada: caída %.1f%% (esperada %.1f%%), confianza %.3f, latencia %.0fs",
+                            alarma["caida_relativa"] * 100,
+                            alarma["caida_esperada"] * 100,
+                            alarma["confianza"],
+                            alarma["latencia_s"],
+                            extra={"campos": {"tick": tick, "alarma": alarma}},
+                        )
+                    else:
+                        log.info("✅ Alarma de fuga despejada tras %.0fs", alarma["duracion_s"])
+                if metricas is not None:
+                    metricas.registrar("detector", time.perf_counter_ns() - td)
+
             # Preparar datos
+            t0 = time.perf_counter_ns()
             datos = sistema.get_datos_mqtt(flujos)
+            if detector is not None:
+                datos["tomas_detectadas"] = bool(detector.en_alarma[0])
 
             # Publicar
+            t1 = time.perf_counter_ns()
             mqtt_manager.publicar_datos(datos)
-
-            # Log de estado - Nuevo sistema con 4 tanques
-            sistema_activo = datos["sistema_activo"]
-
-            # Información de tanques
-            izq1 = datos["tanque_izq_1"]
-            izq2 = datos["tanque_izq_2"]
-            der1 = datos["tanque_der_1"]
-            der2 = datos["tanque_der_2"]
-
-            # Indicadores de estado de válvulas
-            v1_flujo = flujos.get("flujo_v1", 0) > 0
-            v2_flujo = flujos.get("flujo_v2", 0) > 0
-
-            v1_estado = (
-                "🟢💧"
-                if (sistema.valvulas[1].estado and v1_flujo)
-                else "🟢⚪" if sistema.valvulas[1].estado else "🔴"
-            )
-            v2_estado = (
-                "🟢💧"
-                if (sistema.valvulas[2].estado and v2_flujo)
-                else "🟢⚪" if sistema.valvulas[2].estado else "🔴"
-            )
-
-            # Porcentajes de llenado
-            izq1_pct = (izq1 / 1000.0) * 100
-            izq2_pct = (izq2 / 1000.0) * 100
-            der1_pct = (der1 / 1000.0) * 100
-            der2_pct = (der2 / 1000.0) * 100
-
-            # Log principal
-            print(f"📊 {'[ACTIVO]' if sistema_activo else '[PAUSADO]'}")
-            print(
-                f"   Izq: T1={izq1}L({izq1_pct:.0f}%), T2={izq2}L({izq2_pct:.0f}%) | Der: T1={der1}L({der1_pct:.0f}%), T2={der2}L({der2_pct:.0f}%)"
-            )
-            print(
-                f"   Válvulas: V1={v1_estado}({datos['valvula1_presion_interna']:.1f}kPa) | V2={v2_estado}({datos['valvula2_presion_interna']:.1f}kPa)"
-            )
-            print(
-                f"   Sensores: Pre-V1={datos['sensor_pre_v1']:.1f}kPa, Post-V1={datos['sensor_post_v1']:.1f}kPa | Pre-V2={datos['sensor_pre_v2']:.1f}kPa, Post-V2={datos['sensor_post_v2']:.1f}kPa"
-            )
+            t2 = time.perf_counter_ns()
+
+            if historial is not None:
+                historial.registrar(topologia.nombre, time.time(), datos)
+                if metricas is not None:
+                    metricas.registrar("historial", time.perf_counter_ns() - t2)
+                    t2 = time.perf_counter_ns()
+
+            if args.instantanea_cada and tick % args.instantanea_cada == 0:
+                sistema.guardar_instantanea()
+
+            # Resumen de estado muestreado: solo se arma en los ticks registrados
+            if tick % args.log_cada == 0 and log.isEnabledFor(logging.INFO):
+                registrar_estado(sistema, datos, flujos, tick)
+
+            if metricas is not None:
+                fin_tick = time.perf_counter_ns()
+                metricas.registrar("get_datos_mqtt", t1 - t0)
+                metricas.registrar("publicar_datos", t2 - t1)
+                metricas.registrar("log", fin_tick - t2)
+                metricas.registrar("tick", fin_tick - inicio_tick)
+                metricas.incrementar("ticks_total")
+                if fin_tick - inicio_tick > sistema.periodo * 1e9:
+                    metricas.incrementar("ticks_excedidos_total")
+                if args.stats_cada and tick % args.stats_cada == 0:
+                    mqtt_manager.publicar_stats()
 
             # Información de tomas clandestinas removida
 
-            time.sleep(2)
+            # Comparativa de formatos cada 30 ticks
+            if mqtt_manager.codificador and mqtt_manager.medidor_json.frames % 30 == 0:
+                log.info(
+                    "📦 JSON: %s | Binario: %s",
+                    mqtt_manager.medidor_json.resumen(),
+                    mqtt_manager.medidor_binario.resumen(),
+                )
+            if mqtt_manager.deltas and mqtt_manager.medidor_json.frames % 30 == 0:
+                medidor = mqtt_manager.medidor_delta
+                log.info(
+                    "🔺 Deltas: %d/%d ticks publicados, %.0f B/mensaje",
+                    medidor.frames,
+                    mqtt_manager.medidor_json.frames,
+                    medidor.bytes / max(1, medidor.frames),
+                )
 
     except KeyboardInterrupt:
-        print("\n🛑 Simulador detenido")
+        log.info("🛑 Simulador detenido")
     finally:
         mqtt_manager.desconectar()
+        if historial is not None:
+            historial.cerrar()
+        if args.instantanea:
+            sistema.guardar_instantanea()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulador MQTT del sistema de 4 tanques")
+    parser.add_argument(
+        "--binario", action="store_true", help="Publicar también telemetría binaria en tanques/datos/bin"
+    )
+    parser.add_argument(
+        "--delta",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Publicar solo cambios en tanques/datos/delta con keyframe cada N ticks",
+    )
+    parser.add_argument(
+        "--banda-muerta",
+        type=float,
+        default=0.0,
+        help="Variación numérica mínima para incluir un campo en el delta",
+    )
+    parser.add_argument("--log-nivel", default="INFO", help="DEBUG, INFO, WARNING o ERROR")
+    parser.add_argument("--log-formato", choices=["texto", "jsonl"], default="texto")
+    parser.add_argument("--log-archivo", help="Escribir el log a un archivo en vez de stdout")
+    parser.add_argument(
+        "--log-cada", type=int, default=1, metavar="N", help="Registrar el resumen de estado cada N ticks"
+    )
+    parser.add_argument(
+        "--metricas-puerto", type=int, default=0, help="Servir métricas Prometheus en 127.0.0.1:PUERTO/metrics"
+    )
+    parser.add_argument(
+        "--stats-cada", type=int, default=0, metavar="N", help="Publicar métricas en tanques/stats cada N ticks"
+    )
+    parser.add_argument("--topologia", help="JSON de topología (por defecto la planta de 4 tanques)")
+    parser.add_argument("--historial", metavar="DIR", help="Grabar cada frame en el historial en disco de DIR")
+    parser.add_argument(
+        "--reposo",
+        type=float,
+        default=0.0,
+        metavar="S",
+        help="Sin flujo en ningún tanque, publicar cada S segundos (un comando fuerza un tick inmediato)",
+    )
+    parser.add_argument(
+        "--instantanea",
+        metavar="ARCHIVO",
+        help="Archivo de instantáneas: se escribe con el comando instantanea, cada --instantanea-cada ticks y al salir",
+    )
+    parser.add_argument("--instantanea-cada", type=int, default=0, metavar="N")
+    parser.add_argument("--restaurar", action="store_true", help="Arrancar desde --instantanea si existe")
+    args = parser.parse_args()
+    if (args.restaurar or args.instantanea_cada) and not args.instantanea:
+        parser.error("--restaurar y --instantanea-cada requieren --instantanea")
+    if args.log_cada < 1:
+        parser.error("--log-cada debe ser al menos 1")
+
+    topologia = cargar_topologia(args.topologia)
+    if args.binario and topologia.modelo != "serie_4_tanques":
+        parser.error("--binario solo está disponible para la planta de 4 tanques")
+
+    listener = configurar_registro(args.log_nivel, args.log_formato, args.log_archivo)
+    try:
+        ejecutar(args, topologia)
+    finally:
+        # Con el listener detenido se vuelcan los registros pendientes (p. ej. el error de conexión)
+        listener.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,50 @@
+from typing import Dict, Any, Optional
+
+
+class PublicadorDeltas:
+    """Genera mensajes delta (solo campos cambiados) con keyframes periódicos"""
+
+    def __init__(self, intervalo_keyframe: int = 30, banda_muerta: float = 0.0):
+        self.intervalo_keyframe = intervalo_keyframe
+        # Cambios numéricos menores o iguales a la banda muerta no se publican
+        self.banda_muerta = banda_muerta
+        self.secuencia = 0
+        self._ultimo: Dict[str, Any] = {}
+        self._ticks_desde_keyframe = 0
+        self._forzar_keyframe = True
+
+    def solicitar_keyframe(self):
+        """Fuerza un keyframe en el próximo tick (resync de un suscriptor)"""
+        self._forzar_keyframe = True
+
+    def _cambio(self, campo: str, valor: Any) -> bool:
+        anterior = self._ultimo.get(campo)
+        numericos = all(
+            isinstance(v, (int, float)) and not isinstance(v, bool) for v in (valor, anterior)
+        )
+        if numericos:
+            return abs(valor - anterior) > self.banda_muerta
+        return anterior != valor
+
+    def siguiente_mensaje(self, datos: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Devuelve el mensaje a publicar para este tick, o None si nada cambió"""
+        # "flujos" duplica flujo_total sin redondear: se omite de la comparación
+        campos = {k: v for k, v in datos.items() if k != "flujos"}
+        self._ticks_desde_keyframe += 1
+
+        if self._forzar_keyframe or self._ticks_desde_keyframe >= self.intervalo_keyframe:
+            tipo = "keyframe"
+            cambios = campos
+            self._forzar_keyframe = False
+            self._ticks_desde_keyframe = 0
+        else:
+            tipo = "delta"
+            cambios = {k: v for k, v in campos.items() if self._cambio(k, v)}
+            if not cambios:
+                return None
+
+        # Se compara contra el último valor publicado para que la deriva lenta se acumule
+        self._ultimo.update(cambios)
+        self.secuencia += 1
+        # Los suscriptores detectan huecos comparando seq con el último recibido + 1
+        return {"tipo": tipo, "seq": self.secuencia, "campos": cambios}
@@ -0,0 +1,71 @@
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+from typing import Optional
+
+
+class FormateadorJSON(logging.Formatter):
+    """Una línea JSON por registro; los campos estructurados van en extra={"campos": {...}}"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        linea = {
+            "ts": round(record.created, 3),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "mensaje": record.getMessage(),
+        }
+        campos = getattr(record, "campos", None)
+        if campos:
+            linea.update(campos)
+        if record.exc_info:
+            linea["excepcion"] = self.formatException(record.exc_info)
+        return json.dumps(linea, ensure_ascii=False)
+
+
+class ManejadorColaNoBloqueante(logging.handlers.QueueHandler):
+    """Encola registros sin formatearlos ni bloquear; si la cola está llena los descarta"""
+
+    def __init__(self, cola: queue.Queue):
+        super().__init__(cola)
+        self.descartados = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Mismo proceso: el formateo (texto o JSON) se hace en el hilo del listener
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+
+def configurar_registro(
+    nivel: str = "INFO",
+    formato: str = "texto",
+    archivo: Optional[str] = None,
+    capacidad: int = 10000,
+) -> logging.handlers.QueueListener:
+    """Configura el logger "simulador" con un handler en cola y escritura en segundo plano"""
+    if archivo:
+        destino: logging.Handler = logging.FileHandler(archivo, encoding="utf-8")
+    else:
+        destino = logging.StreamHandler(sys.stdout)
+
+    if formato == "jsonl":
+        destino.setFormatter(FormateadorJSON())
+    else:
+        formateador = logging.Formatter("%(asctime)s %(levelname)-7s %(message)s", "%H:%M:%S")
+        destino.setFormatter(formateador)
+
+    cola: queue.Queue = queue.Queue(maxsize=capacidad)
+    logger = logging.getLogger("simulador")
+    logger.setLevel(nivel.upper())
+    logger.handlers = [ManejadorColaNoBloqueante(cola)]
+    logger.propagate = False
+
+    listener = logging.handlers.QueueListener(cola, destino, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,109 @@
+from typing import Dict, Any, List, Optional, Union
+
+import numpy as np
+
+
+# Valores U[0, 1) pre-generados por bloque en la ruta escalar
+BLOQUE_ESCALAR = 4096
+# Ticks pre-generados por planta en la flota (memoria: plantas x BLOQUE_TICKS x slots x 8 B)
+BLOQUE_TICKS = 64
+
+
+def semillas_por_planta(
+    semilla: Optional[int], n_plantas: int, desde: int = 0
+) -> List[np.random.SeedSequence]:
+    """Subsemillas independientes: la de la planta i depende solo de (semilla, i), no del tamaño de la flota.
+    Con `desde` se obtienen las de las plantas desde..desde+n_plantas-1 (las de un fragmento)"""
+    raiz = np.random.SeedSequence(semilla)
+    # Idénticas a raiz.spawn(), pero direccionables por índice global
+    return [
+        np.random.SeedSequence(raiz.entropy, spawn_key=raiz.spawn_key + (i,))
+        for i in range(desde, desde + n_plantas)
+    ]
+
+
+class RuidoBloques:
+    """Fuente de ruido con uniform(a, b) como el módulo random, sobre un Generator de NumPy
+    propio y sembrado; los valores se generan en bloques y se consumen de a uno"""
+
+    def __init__(
+        self,
+        semilla: Union[None, int, np.random.SeedSequence, np.random.Generator] = None,
+        bloque: int = BLOQUE_ESCALAR,
+    ):
+        if isinstance(semilla, np.random.Generator):
+            self.generador = semilla
+        else:
+            self.generador = np.random.default_rng(semilla)
+        self.bloque = bloque
+        self._valores: List[float] = []
+        self._posicion = 0
+        # Estado del generador antes de generar el bloque en curso: basta con él y la posición
+        # para reconstruir el bloque, sin guardar sus valores
+        self._estado_bloque: Optional[Dict[str, Any]] = None
+        # Posición a retomar en el próximo bloque (tras restaurar(), que lo regenera recién al usarlo)
+        self._retomar = 0
+
+    def uniform(self, a: float, b: float) -> float:
+        posicion = self._posicion
+        if posicion == len(self._valores):
+            self._estado_bloque = self.generador.bit_generator.state
+            self._valores = self.generador.random(self.bloque).tolist()
+            posicion = self._retomar
+            self._retomar = 0
+        self._posicion = posicion + 1
+        return a + (b - a) * self._valores[posicion]
+
+    def estado(self) -> Dict[str, Any]:
+        """Estado serializable; con restaurar() la secuencia sigue exactamente donde quedó"""
+        if self._retomar:
+            return {"generador": self._estado_bloque, "bloque": self.bloque, "posicion": self._retomar}
+        if self._posicion == len(self._valores):
+            # Sin bloque o agotado: el próximo valor sale del estado actual del generador
+            return {"generador": self.generador.bit_generator.state, "bloque": self.bloque, "posicion": 0}
+        return {"generador": self._estado_bloque, "bloque": self.bloque, "posicion": self._posicion}
+
+    def restaurar(self, estado: Dict[str, Any]):
+        self.generador.bit_generator.state = estado["generador"]
+        self.bloque = estado["bloque"]
+        self._estado_bloque = estado["generador"]
+        self._valores = []
+        self._posicion = 0
+        self._retomar = estado["posicion"]
+
+
+class RuidoFlota:
+    """Ruido por tick para N plantas: un Generator por planta (subsemillas de semillas_por_planta)
+    que pre-genera BLOQUE_TICKS ticks de una vez"""
+
+    def __init__(
+        self, semilla: Optional[int], n_plantas: int, slots: int, bloque: int = BLOQUE_TICKS, desde: int = 0
+    ):
+        self.generadores = [np.random.default_rng(s) for s in semillas_por_planta(semilla, n_plantas, desde)]
+        # (ticks, plantas, slots): cada tick es un bloque contiguo para las operaciones vectoriales
+        self._bloque = np.empty((bloque, n_plantas, slots))
+        self._tick = bloque
+
+    def siguiente(self) -> np.ndarray:
+        """Valores U[0, 1) del próximo tick, forma (plantas, slots)"""
+        if self._tick == len(self._bloque):
+            forma = (len(self._bloque), self._bloque.shape[2])
+            for i, generador in enumerate(self.generadores):
+                self._bloque[:, i] = generador.random(forma)
+            self._tick = 0
+        u = self._bloque[self._tick]
+        self._tick += 1
+        return u
+
+    def saltar(self, ticks: int):
+        """Deja la secuencia como tras `ticks` llamadas a siguiente() desde la semilla, sin generarlas:
+        cada bloque consume exactamente bloque x slots valores por generador"""
+        bloque, slots = len(self._bloque), self._bloque.shape[2]
+        completos, resto = divmod(ticks, bloque)
+        for generador in self.generadores:
+            generador.bit_generator.advance(completos * bloque * slots)
+        self._tick = bloque
+        if resto:
+            # El bloque en curso se regenera entero y se retoma en su posición
+            self.siguiente()
+            self._tick = resto
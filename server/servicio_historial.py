@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import logging
+import math
+import queue
+import threading
+import time
+from typing import Dict, Any, List
+
+import numpy as np
+import paho.mqtt.client as mqtt
+from paho.mqtt.client import CallbackAPIVersion
+
+from historial import Historial, HistorialPlanta
+from registro import configurar_registro
+
+log = logging.getLogger("simulador.servicio_historial")
+
+
+TOPICO_CONSULTA = "tanques/historial/consulta"
+TOPICO_REPLAY = "tanques/historial/replay"
+# Respuestas por id de solicitud; los frames reproducidos van a un tópico propio por replay
+TOPICO_RESPUESTA = "tanques/historial/respuesta/{id}"
+TOPICO_FRAMES_REPLAY = "tanques/replay/{id}/datos"
+
+TAMANO_PAGINA = 500
+MAX_TAMANO_PAGINA = 5000
+MAX_REPLAYS = 8
+
+
+def _lista(valores: np.ndarray, booleana: bool = False) -> List[Any]:
+    """Columna float32 -> lista JSON (sin el ruido de float32; NaN como null)"""
+    if booleana:
+        return [None if math.isnan(v) else v != 0 for v in valores.tolist()]
+    redondeados = np.round(valores.astype(np.float64), 4)
+    if np.isnan(redondeados).any():
+        return [None if math.isnan(v) else v for v in redondeados.tolist()]
+    return redondeados.tolist()
+
+
+def _id_valido(solicitud_id: Any) -> bool:
+    # El id forma parte de tópicos: sin separadores ni comodines
+    return (
+        isinstance(solicitud_id, str)
+        and 0 < len(solicitud_id) <= 64
+        and not any(c in solicitud_id for c in "/+#")
+    )
+
+
+class _Replay(threading.Thread):
+    """Re-publica los frames crudos de un rango a `velocidad` veces el ritmo original"""
+
+    def __init__(
+        self, servicio: "ServicioHistorial", solicitud_id: str, planta: HistorialPlanta, solicitud: Dict[str, Any]
+    ):
+        super().__init__(daemon=True, name=f"replay-{solicitud_id}")
+        self.servicio = servicio
+        self.id = solicitud_id
+        self.planta = planta
+        self.desde = float(solicitud["desde"])
+        self.hasta = float(solicitud["hasta"])
+        self.velocidad = float(solicitud.get("velocidad", 1.0))
+        if self.velocidad <= 0:
+            raise ValueError(f"Velocidad inválida: {self.velocidad}")
+        self.detener = threading.Event()
+        self.frames = 0
+
+    def run(self):
+        topico = TOPICO_FRAMES_REPLAY.format(id=self.id)
+        columnas = self.planta.columnas
+        booleanas = [c in self.planta.booleanas for c in columnas]
+        inicio_real = time.monotonic()
+        inicio_t = None
+        try:
+            for t, valores in self.planta.bloques_crudos(self.desde, self.hasta):
+                filas = list(zip(*[_lista(v, b) for v, b in zip(valores, booleanas)]))
+                for t_frame, fila in zip(t.tolist(), filas):
+                    if inicio_t is None:
+                        inicio_t = t_frame
+                    # Espera hasta el instante escalado; detener() corta la espera
+                    espera = inicio_real + (t_frame - inicio_t) / self.velocidad - time.monotonic()
+                    if espera > 0 and self.detener.wait(espera):
+                        return
+                    if self.detener.is_set():
+                        return
+                    datos = dict(zip(columnas, fila))
+                    datos["t"] = t_frame
+                    self.servicio.publicar(topico, json.dumps(datos))
+                    self.frames += 1
+        finally:
+            self.servicio.fin_replay(self)
+
+
+class ServicioHistorial:
+    """Responde consultas de rango y reproduce sesiones grabadas sobre MQTT (solicitud-respuesta)"""
+
+    def __init__(self, historial: Historial, host: str = "localhost", puerto: int = 1883):
+        self.historial = historial
+        self.host = host
+        self.puerto = puerto
+        # Las consultas se resuelven en un hilo propio para no bloquear el hilo de red de paho
+        self.solicitudes: "queue.Queue[tuple]" = queue.Queue(maxsize=256)
+        self.replays: Dict[str, _Replay] = {}
+        self._lock = threading.Lock()
+        self.atendidas = 0
+        self.descartadas = 0
+        self.client = mqtt.Client(callback_api_version=CallbackAPIVersion.VERSION1)
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+
+    def on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            log.info("✅ MQTT Conectado")
+            client.subscribe(TOPICO_CONSULTA)
+            client.subscribe(TOPICO_REPLAY)
+            log.info("🗄️  Historial en %s: %s", self.historial.directorio, self.historial.disponibles())
+        else:
+            log.error("❌ Error MQTT: %s", rc)
+
+    def on_message(self, client, userdata, msg):
+        try:
+            solicitud = json.loads(msg.payload.decode())
+            if not isinstance(solicitud, dict):
+                # Sin objeto no hay id ni tópico de respuesta: solo queda registrarlo
+                log.error("❌ Solicitud inválida en %s: se esperaba un objeto JSON", msg.topic)
+                return
+            self.solicitudes.put_nowait((msg.topic, solicitud))
+        except queue.Full:
+            self.descartadas += 1
+            log.warning("⚠️  Cola de solicitudes llena, descartada")
+        except Exception as e:
+            log.error("❌ Solicitud inválida: %s", e)
+
+    def publicar(self, topico: str, mensaje: str):
+        self.client.publish(topico, mensaje)
+
+    def responder(self, solicitud_id: str, respuesta: Dict[str, Any]):
+        respuesta["id"] = solicitud_id
+        self.publicar(TOPICO_RESPUESTA.format(id=solicitud_id), json.dumps(respuesta))
+
+    def _planta(self, solicitud: Dict[str, Any]) -> HistorialPlanta:
+        disponibles = self.historial.disponibles()
+        planta_id = solicitud.get("planta")
+        if planta_id is None and len(disponibles) == 1:
+            planta_id = disponibles[0]
+        if planta_id not in disponibles:
+            raise KeyError(f"Planta sin historial: {planta_id!r} (disponibles: {disponibles})")
+        return self.historial.planta(planta_id)
+
+    def atender(self, topico: str, solicitud: Dict[str, Any]):
+        """Resuelve una solicitud; los errores vuelven al solicitante en su tópico de respuesta"""
+        if not isinstance(solicitud, dict):
+            log.warning("⚠️  Solicitud descartada, no es un objeto JSON: %r", solicitud)
+            return
+        solicitud_id = solicitud.get("id")
+        if not _id_valido(solicitud_id):
+            log.warning("⚠️  Solicitud sin id válido: %s", solicitud)
+            return
+        try:
+            if topico == TOPICO_CONSULTA:
+                self.consultar(solicitud_id, solicitud)
+            elif solicitud.get("detener"):
+                self.detener_replay(solicitud_id)
+            else:
+                self.iniciar_replay(solicitud_id, solicitud)
+            self.atendidas += 1
+        except (KeyError, ValueError, TypeError) as e:
+            # str() de un KeyError agrega comillas: se devuelve el mensaje tal cual
+            mensaje = e.args[0] if isinstance(e, KeyError) and e.args else str(e)
+            self.responder(solicitud_id, {"error": mensaje})
+        except Exception as e:
+            log.exception("❌ Error inesperado en la solicitud %s", solicitud_id)
+            self.responder(solicitud_id, {"error": f"Error interno: {type(e).__name__}"})
+
+    def consultar(self, solicitud_id: str, solicitud: Dict[str, Any]):
+        """Consulta de rango paginada: todas las páginas, o solo "pagina" si se pide una"""
+        planta = self._planta(solicitud)
+        hasta = float(solicitud.get("hasta", time.time()))
+        desde = float(solicitud.get("desde", hasta - 3600))
+        resultado = planta.consultar(
+            desde,
+            hasta,
+            solicitud.get("columnas"),
+            solicitud.get("resolucion"),
+            int(solicitud.get("max_puntos", 1000)),
+        )
+        tamano = max(1, min(MAX_TAMANO_PAGINA, int(solicitud.get("tamano_pagina", TAMANO_PAGINA))))
+        t = resultado["t"]
+        paginas = max(1, math.ceil(len(t) / tamano))
+        pedidas = [int(solicitud["pagina"])] if "pagina" in solicitud else range(paginas)
+        crudo = resultado["resolucion"] == planta.niveles[0][0]
+
+        for pagina in pedidas:
+            if not 0 <= pagina < paginas:
+                raise ValueError(f"Página fuera de rango: {pagina} (páginas: {paginas})")
+            s = slice(pagina * tamano, (pagina + 1) * tamano)
+            if crudo:
+                series = {c: _lista(v[s], c in planta.booleanas) for c, v in resultado["series"].items()}
+            else:
+                series = {
+                    c: {e: _lista(v[s]) for e, v in estadisticos.items()}
+                    for c, estadisticos in resultado["series"].items()
+                }
+            self.responder(
+                solicitud_id,
+                {
+                    "resolucion": resultado["resolucion"],
+                    "pagina": pagina,
+                    "paginas": paginas,
+                    "puntos": len(t),
+                    "t": t[s].tolist(),
+                    "series": series,
+                },
+            )
+
+    def iniciar_replay(self, solicitud_id: str, solicitud: Dict[str, Any]):
+        planta = self._planta(solicitud)
+        with self._lock:
+            if solicitud_id in self.replays:
+                raise ValueError(f"Replay ya en curso: {solicitud_id}")
+            if len(self.replays) >= MAX_REPLAYS:
+                raise ValueError(f"Demasiados replays simultáneos (máximo {MAX_REPLAYS})")
+            replay = _Replay(self, solicitud_id, planta, solicitud)
+            self.replays[solicitud_id] = replay
+        topico = TOPICO_FRAMES_REPLAY.format(id=solicitud_id)
+        self.responder(solicitud_id, {"replay": "iniciado", "topico": topico, "velocidad": replay.velocidad})
+        log.info("⏯️  Replay %s: %s x%g", solicitud_id, planta.directorio, replay.velocidad)
+        replay.start()
+
+    def detener_replay(self, solicitud_id: str):
+        with self._lock:
+            replay = self.replays.get(solicitud_id)
+        if replay is None:
+            raise KeyError(f"Replay inexistente: {solicitud_id}")
+        replay.detener.set()
+
+    def fin_replay(self, replay: _Replay):
+        with self._lock:
+            self.replays.pop(replay.id, None)
+        estado = "detenido" if replay.detener.is_set() else "fin"
+        self.responder(replay.id, {"replay": estado, "frames": replay.frames})
+        log.info("⏹️  Replay %s: %s tras %d frames", replay.id, estado, replay.frames)
+
+    def ejecutar(self):
+        """Conecta y atiende solicitudes hasta KeyboardInterrupt"""
+        try:
+            self.client.connect(self.host, self.puerto, 60)
+        except Exception as e:
+            log.error("❌ Error conectando: %s", e)
+            return
+        self.client.loop_start()
+        try:
+            while True:
+                topico, solicitud = self.solicitudes.get()
+                try:
+                    self.atender(topico, solicitud)
+                except Exception:
+                    # Una solicitud rara no debe tumbar el servicio
+                    log.exception("❌ Error inesperado atendiendo %s", topico)
+        finally:
+            for replay in list(self.replays.values()):
+                replay.detener.set()
+            self.client.disconnect()
+            self.client.loop_stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Consultas y replay del historial grabado vía MQTT")
+    parser.add_argument("directorio", help="Directorio del historial (--historial del simulador)")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--puerto", type=int, default=1883)
+    parser.add_argument("--log-nivel", default="INFO")
+    parser.add_argument("--log-formato", choices=["texto", "jsonl"], default="texto")
+    args = parser.parse_args()
+
+    listener = configurar_registro(args.log_nivel, args.log_formato)
+    # Solo lectura: el simulador puede seguir grabando en el mismo directorio
+    servicio = ServicioHistorial(Historial(args.directorio, solo_lectura=True), args.host, args.puerto)
+    try:
+        servicio.ejecutar()
+    except KeyboardInterrupt:
+        log.info("🛑 Servicio de historial detenido")
+    finally:
+        listener.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import json
+import struct
+import time
+from typing import Dict, Any, List, Tuple
+
+
+ESQUEMA_VERSION = 1
+
+# Válvulas codificadas como bits (bit i = válvula i + 1)
+CAMPOS_VALVULAS = [
+    "valvula1_estado",
+    "valvula2_estado",
+    "valvula_tanque_izq_1_estado",
+    "valvula_tanque_izq_2_estado",
+    "valvula_tanque_der_1_estado",
+    "valvula_tanque_der_2_estado",
+]
+
+# (campo, tipo struct, escala): el valor viaja como entero = round(valor * escala)
+CAMPOS_NUMERICOS: List[Tuple[str, str, int]] = [
+    ("tanque_izq_1", "H", 10),
+    ("tanque_izq_2", "H", 10),
+    ("tanque_der_1", "H", 10),
+    ("tanque_der_2", "H", 10),
+    ("valvula1_presion_interna", "h", 10),
+    ("valvula2_presion_interna", "h", 10),
+    ("valvula_tanque_izq_1_presion", "h", 10),
+    ("valvula_tanque_izq_2_presion", "h", 10),
+    ("valvula_tanque_der_1_presion", "h", 10),
+    ("valvula_tanque_der_2_presion", "h", 10),
+    ("sensor_pre_v1", "h", 10),
+    ("sensor_post_v1", "h", 10),
+    ("sensor_pre_v2", "h", 10),
+    ("sensor_post_v2", "h", 10),
+    ("flujo_total", "h", 100),
+]
+
+# Cabecera: versión, banderas (bit0 = sistema_activo), bits de válvulas, secuencia
+FORMATO = "<BBBI" + "".join(tipo for _, tipo, _ in CAMPOS_NUMERICOS)
+
+
+class CodificadorBinario:
+    """Codifica el payload de get_datos_mqtt en un frame de layout fijo"""
+
+    def __init__(self):
+        self._struct = struct.Struct(FORMATO)
+        self.secuencia = 0
+
+    def descriptor(self) -> str:
+        """Descriptor versionado del esquema (se publica retenido)"""
+        return json.dumps({
+            "version": ESQUEMA_VERSION,
+            "formato": FORMATO,
+            "tamano": self._struct.size,
+            "cabecera": ["version", "banderas", "valvulas", "secuencia"],
+            "banderas": ["sistema_activo"],
+            "valvulas": CAMPOS_VALVULAS,
+            "campos": [
+                {"nombre": nombre, "tipo": tipo, "escala": escala}
+                for nombre, tipo, escala in CAMPOS_NUMERICOS
+            ],
+        })
+
+    def codificar(self, datos: Dict[str, Any]) -> bytes:
+        """Empaqueta un frame con el siguiente número de secuencia"""
+        valvulas = 0
+        for bit, campo in enumerate(CAMPOS_VALVULAS):
+            if datos[campo]:
+                valvulas |= 1 << bit
+        frame = self._struct.pack(
+            ESQUEMA_VERSION,
+            1 if datos["sistema_activo"] else 0,
+            valvulas,
+            self.secuencia & 0xFFFFFFFF,
+            *(round(datos[nombre] * escala) for nombre, _, escala in CAMPOS_NUMERICOS),
+        )
+        self.secuencia += 1
+        return frame
+
+    def decodificar(self, frame: bytes) -> Dict[str, Any]:
+        """Reconstruye los campos del payload a partir de un frame"""
+        version, banderas, valvulas, secuencia, *valores = self._struct.unpack(frame)
+        if version != ESQUEMA_VERSION:
+            raise ValueError(f"Versión de esquema no soportada: {version}")
+        datos: Dict[str, Any] = {"secuencia": secuencia, "sistema_activo": bool(banderas & 1)}
+        for bit, campo in enumerate(CAMPOS_VALVULAS):
+            datos[campo] = bool(valvulas & (1 << bit))
+        for (nombre, _, escala), valor in zip(CAMPOS_NUMERICOS, valores):
+            datos[nombre] = valor / escala
+        return datos
+
+
+class MedidorFormato:
+    """Acumula bytes y tiempo de codificación por tick de un formato"""
+
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+        self.ns = 0
+
+    def registrar(self, tamano: int, ns: int):
+        self.frames += 1
+        self.bytes += tamano
+        self.ns += ns
+
+    def resumen(self) -> str:
+        if not self.frames:
+            return "sin datos"
+        return f"{self.bytes / self.frames:.0f} B/tick, {self.ns / self.frames / 1000:.1f} µs"
+
+
+def medir(codificar, *args) -> Tuple[Any, int]:
+    """Ejecuta una codificación y devuelve (resultado, nanosegundos)"""
+    inicio = time.perf_counter_ns()
+    resultado = codificar(*args)
+    return resultado, time.perf_counter_ns() - inicio
@@ -0,0 +1,294 @@
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+
+TOPOLOGIA_POR_DEFECTO = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "topologias", "planta_4_tanques.json"
+)
+
+# Conductancia de la fuga a atmósfera por unidad de intensidad (L/s por kPa)
+CONDUCTANCIA_FUGA = 0.01
+
+
+@dataclass
+class ConfigTanque:
+    id: str
+    nombre: str
+    capacidad: float
+    nivel: float = 0.0
+    presion_base: float = 0.0  # kPa con el tanque vacío (elevación)
+    presion_llena: float = 150.0  # kPa añadidos con el tanque lleno
+
+
+@dataclass
+class ConfigValvula:
+    id: int
+    presion: float = 0.0
+    estado: bool = False
+    descripcion: str = ""
+
+
+@dataclass
+class ConfigTuberia:
+    desde: str
+    hasta: str
+    valvula: Optional[int] = None
+    conductancia: float = 0.05  # L/s por kPa de diferencia
+
+
+@dataclass
+class ConfigSensor:
+    id: str
+    nodo: str
+
+
+@dataclass
+class Topologia:
+    nombre: str
+    # "serie_4_tanques" usa la lógica histórica de calcular_flujos; "red" resuelve el grafo
+    modelo: str
+    tanques: List[ConfigTanque]
+    valvulas: List[ConfigValvula]
+    nodos: List[str] = field(default_factory=list)
+    tuberias: List[ConfigTuberia] = field(default_factory=list)
+    sensores: List[ConfigSensor] = field(default_factory=list)
+    nodo_fuga: Optional[str] = None
+
+    @classmethod
+    def desde_dict(cls, datos: Dict[str, Any]) -> "Topologia":
+        return cls(
+            nombre=datos.get("nombre", "planta"),
+            modelo=datos.get("modelo", "red"),
+            tanques=[ConfigTanque(**t) for t in datos["tanques"]],
+            valvulas=[ConfigValvula(**v) for v in datos["valvulas"]],
+            nodos=list(datos.get("nodos", [])),
+            tuberias=[ConfigTuberia(**t) for t in datos.get("tuberias", [])],
+            sensores=[ConfigSensor(**s) for s in datos.get("sensores", [])],
+            nodo_fuga=datos.get("nodo_fuga"),
+        )
+
+
+def cargar_topologia(ruta: Optional[str] = None) -> Topologia:
+    """Carga una topología desde JSON (por defecto la planta de 4 tanques)"""
+    with open(ruta or TOPOLOGIA_POR_DEFECTO, encoding="utf-8") as f:
+        return Topologia.desde_dict(json.load(f))
+
+
+class RedHidraulica:
+    """Resuelve presiones nodales y flujos de tubería sobre el grafo de una topología"""
+
+    def __init__(self, topologia: Topologia):
+        self.topologia = topologia
+        self.ids_tanques = [t.id for t in topologia.tanques]
+        self.ids_valvulas = [v.id for v in topologia.valvulas]
+        nombres = self.ids_tanques + topologia.nodos
+        indice = {nombre: i for i, nombre in enumerate(nombres)}
+        columna_valvula = {vid: i for i, vid in enumerate(self.ids_valvulas)}
+        for tuberia in topologia.tuberias:
+            for extremo in (tuberia.desde, tuberia.hasta):
+                if extremo not in indice:
+                    raise ValueError(f"Nodo desconocido en tubería: {extremo}")
+
+        self.n_tanques = len(self.ids_tanques)
+        self.n_nodos = len(nombres)
+
+        # Arreglos de índices precalculados: tuberías, válvulas, tanques y sensores
+        self.origen = np.array([indice[t.desde] for t in topologia.tuberias], dtype=np.intp)
+        self.destino = np.array([indice[t.hasta] for t in topologia.tuberias], dtype=np.intp)
+        self.conductancia = np.array([t.conductancia for t in topologia.tuberias])
+        self.valvula_de_tuberia = np.array(
+            [columna_valvula[t.valvula] if t.valvula is not None else -1 for t in topologia.tuberias],
+            dtype=np.intp,
+        )
+        self.con_valvula = self.valvula_de_tuberia >= 0
+        # Tubería controlada por cada válvula (para su presión interna)
+        self.tuberia_de_valvula = np.full(len(self.ids_valvulas), -1, dtype=np.intp)
+        self.tuberia_de_valvula[self.valvula_de_tuberia[self.con_valvula]] = np.flatnonzero(self.con_valvula)
+
+        self.capacidad = np.array([t.capacidad for t in topologia.tanques])
+        self.presion_base = np.array([t.presion_base for t in topologia.tanques])
+        self.presion_llena = np.array([t.presion_llena for t in topologia.tanques])
+        self.nodo_sensor = np.array([indice[s.nodo] for s in topologia.sensores], dtype=np.intp)
+        self.nodo_fuga = indice[topologia.nodo_fuga] if topologia.nodo_fuga else None
+
+        # Patrón disperso fijo del sistema de uniones: fuera de la diagonal solo tuberías unión-unión
+        t = self.n_tanques
+        entre_uniones = np.flatnonzero((self.origen >= t) & (self.destino >= t))
+        self._tuberia_nnz = np.concatenate([entre_uniones, entre_uniones])
+        self._filas = np.concatenate([self.origen[entre_uniones], self.destino[entre_uniones]]) - t
+        self._columnas = np.concatenate([self.destino[entre_uniones], self.origen[entre_uniones]]) - t
+        # Tuberías tanque-unión: aportan al término independiente
+        desde_tanque = (self.origen < t) & (self.destino >= t)
+        hacia_tanque = (self.destino < t) & (self.origen >= t)
+        self._tuberia_borde = np.flatnonzero(desde_tanque | hacia_tanque)
+        self._tanque_borde = np.where(desde_tanque, self.origen, self.destino)[self._tuberia_borde]
+        self._union_borde = np.where(desde_tanque, self.destino, self.origen)[self._tuberia_borde] - t
+        # Vecinos por nodo para detectar uniones sin camino abierto a un tanque
+        self._vecinos: List[List[Tuple[int, int]]] = [[] for _ in range(self.n_nodos)]
+        for k, (o, d) in enumerate(zip(self.origen.tolist(), self.destino.tolist())):
+            self._vecinos[o].append((d, k))
+            self._vecinos[d].append((o, k))
+
+        # Valores del sistema para el último estado de válvulas/fuga (se reconstruyen solo si cambia)
+        self._clave: Optional[Tuple[bytes, float]] = None
+        self.reconstrucciones = 0
+        self.iteraciones = 0
+        self.tolerancia = 1e-10
+
+        self.presiones = np.zeros(self.n_nodos)
+
+    def _anclados(self, g: np.ndarray, conductancia_fuga: float) -> np.ndarray:
+        """Nodos con camino abierto a un tanque (o a la fuga); el resto quedaría indeterminado"""
+        anclado = np.zeros(self.n_nodos, dtype=bool)
+        pendientes = list(range(self.n_tanques))
+        if self.nodo_fuga is not None and conductancia_fuga > 0:
+            pendientes.append(self.nodo_fuga)
+        anclado[pendientes] = True
+        abierta = (g > 0).tolist()
+        while pendientes:
+            nodo = pendientes.pop()
+            for vecino, tuberia in self._vecinos[nodo]:
+                if abierta[tuberia] and not anclado[vecino]:
+                    anclado[vecino] = True
+                    pendientes.append(vecino)
+        return anclado
+
+    def _preparar(self, estados: np.ndarray, conductancia_fuga: float):
+        """Recalcula los valores del sistema sobre el patrón fijo tras un cambio de válvulas o fuga"""
+        t = self.n_tanques
+        abierta = np.ones(len(self.origen), dtype=bool)
+        abierta[self.con_valvula] = estados[self.valvula_de_tuberia[self.con_valvula]]
+        self._g = np.where(abierta, self.conductancia, 0.0)
+
+        n = self.n_nodos - t
+        diagonal = (
+            np.bincount(self.origen, self._g, self.n_nodos) + np.bincount(self.destino, self._g, self.n_nodos)
+        )[t:]
+        if self.nodo_fuga is not None:
+            diagonal[self.nodo_fuga - t] += conductancia_fuga
+
+        # Uniones sin camino a un tanque (aisladas o en un tramo cerrado) quedan a presión 0
+        self._libres = self._anclados(self._g, conductancia_fuga)[t:]
+        diagonal[~self._libres] = 1.0
+        self._diagonal = diagonal
+        self._inversa_diagonal = 1.0 / diagonal
+        self._valores = self._g[self._tuberia_nnz]
+        self._g_borde = self._g[self._tuberia_borde]
+        self._n_uniones = n
+        self.reconstrucciones += 1
+
+    def _multiplicar(self, x: np.ndarray) -> np.ndarray:
+        return self._diagonal * x - np.bincount(
+            self._filas, self._valores * x[self._columnas], self._n_uniones
+        )
+
+    def _gradiente_conjugado(self, b: np.ndarray, x: np.ndarray) -> np.ndarray:
+        """CG precondicionado con Jacobi; x es el punto de partida (solución del tick anterior)"""
+        r = b - self._multiplicar(x)
+        z = r * self._inversa_diagonal
+        d = z.copy()
+        rz = r @ z
+        limite = (self.tolerancia * max(float(np.sqrt(b @ b)), 1.0)) ** 2
+        iteraciones = 0
+        while r @ r > limite and iteraciones < 10 * self._n_uniones:
+            ad = self._multiplicar(d)
+            alfa = rz / (d @ ad)
+            x += alfa * d
+            r -= alfa * ad
+            z = r * self._inversa_diagonal
+            rz_nuevo = r @ z
+            d = z + (rz_nuevo / rz) * d
+            rz = rz_nuevo
+            iteraciones += 1
+        self.iteraciones = iteraciones
+        return x
+
+    def resolver(
+        self, niveles: np.ndarray, estados: np.ndarray, conductancia_fuga: float = 0.0
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Calcula presiones nodales (tanques como presión fija, uniones por conservación de masa)
+        y devuelve también la conductancia efectiva de cada tubería"""
+        t = self.n_tanques
+        clave = (estados.tobytes(), conductancia_fuga)
+        if clave != self._clave:
+            self._preparar(estados, conductancia_fuga)
+            self._clave = clave
+
+        presion_tanques = self.presion_base + self.presion_llena * niveles / self.capacidad
+        b = np.bincount(self._union_borde, self._g_borde * presion_tanques[self._tanque_borde], self._n_uniones)
+
+        # Arranque en caliente: los niveles cambian poco entre ticks
+        x = self.presiones[t:].copy()
+        x[~self._libres] = 0.0
+        self.presiones[:t] = presion_tanques
+        self.presiones[t:] = self._gradiente_conjugado(b, x) if self._n_uniones else x
+        return self.presiones, self._g
+
+    def calcular_flujos(self, sistema) -> Dict[str, float]:
+        """Equivalente en grafo de SistemaSimulacion.calcular_flujos para cualquier topología"""
+        tanques = [sistema.tanques[tid] for tid in self.ids_tanques]
+        valvulas = [sistema.valvulas[vid] for vid in self.ids_valvulas]
+        niveles = np.fromiter((t.nivel_actual for t in tanques), float, len(tanques))
+        estados = np.fromiter((v.estado for v in valvulas), bool, len(valvulas))
+        conductancia_fuga = CONDUCTANCIA_FUGA * sistema.fuga_intensidad if sistema.simulando_fuga else 0.0
+
+        p, g = self.resolver(niveles, estados, conductancia_fuga)
+
+        # Flujo positivo de origen a destino; neto entrante por nodo
+        q = g * (p[self.origen] - p[self.destino])
+        entrante = np.bincount(self.destino, q, self.n_nodos) - np.bincount(self.origen, q, self.n_nodos)
+
+        for tanque, neto in zip(tanques, entrante[: self.n_tanques].tolist()):
+            tanque.flujo_entrada = max(0.0, neto)
+            tanque.flujo_salida = max(0.0, -neto)
+
+        for sensor, presion in zip(self.topologia.sensores, p[self.nodo_sensor].tolist()):
+            sistema.sensores[sensor.id]["presion"] = presion
+
+        # Presión interna: la del extremo aguas arriba con la válvula abierta, 0 cerrada
+        tub = self.tuberia_de_valvula
+        presion_valvulas = np.where(
+            estados & (tub >= 0), np.maximum(p[self.origen[tub]], p[self.destino[tub]]), 0.0
+        )
+        for valvula, presion in zip(valvulas, presion_valvulas.tolist()):
+            valvula.presion = presion
+
+        flujo_fuga = conductancia_fuga * p[self.nodo_fuga] if self.nodo_fuga is not None else 0.0
+        return {
+            "flujo_total": float(np.maximum(entrante[: self.n_tanques], 0.0).sum()),
+            "flujo_fuga": float(flujo_fuga),
+        }
+
+
+def malla(lado: int, conductancia: float = 0.05) -> Topologia:
+    """Topología sintética: malla lado x lado con lazos, 2 tanques fuente y 2 destino en las esquinas"""
+    nodos = [f"n{i}_{j}" for i in range(lado) for j in range(lado)]
+    tuberias = []
+    for i in range(lado):
+        for j in range(lado):
+            if i + 1 < lado:
+                tuberias.append(ConfigTuberia(f"n{i}_{j}", f"n{i + 1}_{j}", conductancia=conductancia))
+            if j + 1 < lado:
+                tuberias.append(ConfigTuberia(f"n{i}_{j}", f"n{i}_{j + 1}", conductancia=conductancia))
+    esquinas = [(0, 0), (0, lado - 1), (lado - 1, 0), (lado - 1, lado - 1)]
+    tanques = []
+    valvulas = []
+    for k, (i, j) in enumerate(esquinas):
+        tanques.append(ConfigTanque(f"tanque_{k + 1}", f"Tanque {k + 1}", 1000.0, 1000.0 if k < 2 else 0.0))
+        valvulas.append(ConfigValvula(k + 1, estado=True))
+        tuberias.append(ConfigTuberia(f"tanque_{k + 1}", f"n{i}_{j}", valvula=k + 1, conductancia=conductancia))
+    centro = f"n{lado // 2}_{lado // 2}"
+    return Topologia(
+        nombre=f"malla_{lado}x{lado}",
+        modelo="red",
+        tanques=tanques,
+        valvulas=valvulas,
+        nodos=nodos,
+        tuberias=tuberias,
+        sensores=[ConfigSensor("sensor_centro", centro)],
+        nodo_fuga=centro,
+    )